@@ -0,0 +1,291 @@
+import asyncio
+import json
+import logging
+import math
+import re
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Pattern, Tuple
+from pymongo import ReturnDocument
+from app.core.auth import decode_token_subject
+from app.core.config import settings
+
+
+@dataclass(frozen=True)
+class AdmissionRule:
+    """
+    Regla de admisión para un endpoint costoso
+    - cost: tokens que consume cada petición del bucket del usuario y de la IP
+    - endpoint_class: grupo que comparte el límite global de concurrencia
+    """
+    method: str
+    path: Pattern
+    cost: float
+    endpoint_class: str
+
+
+# Endpoints que llaman a servicios externos (Nominatim, Cloudinary) o leen mapas completos
+DEFAULT_RULES: List[AdmissionRule] = [
+    AdmissionRule("POST", re.compile(r"^/markers/?$"), 5, "geocode"),
+    AdmissionRule("POST", re.compile(r"^/markers/async$"), 3, "geocode"),
+    AdmissionRule("POST", re.compile(r"^/markers/bulk/update$"), 10, "bulk"),
+    AdmissionRule("POST", re.compile(r"^/markers/bulk/delete$"), 5, "bulk"),
+    AdmissionRule("PUT", re.compile(r"^/markers/[^/]+/image$"), 5, "upload"),
+    AdmissionRule("PUT", re.compile(r"^/markers/[^/]+$"), 2, "geocode"),
+    AdmissionRule("GET", re.compile(r"^/markers/user/[^/]+$"), 1, "public_read"),
+    AdmissionRule("GET", re.compile(r"^/markers/tiles/"), 0.2, "public_read"),
+]
+
+
+class TokenBucketStore(ABC):
+    """
+    Almacén de contadores token bucket
+    consume() retorna 0 si la petición se admite o los segundos a esperar si no
+    """
+    
+    @abstractmethod
+    async def consume(self, key: str, cost: float, capacity: float, refill_per_second: float) -> float:
+        ...
+
+
+class InMemoryTokenBucketStore(TokenBucketStore):
+    """
+    Buckets en memoria del proceso (no compartidos entre instancias)
+    consume() no cede el event loop, así que leer y escribir el bucket es atómico
+    """
+    
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._buckets: Dict[str, Tuple[float, float]] = {}  # key -> (tokens, updated_at)
+    
+    async def consume(self, key: str, cost: float, capacity: float, refill_per_second: float) -> float:
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.get(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated_at) * refill_per_second)
+        
+        if tokens >= cost:
+            self._buckets[key] = (tokens - cost, now)
+            retry_after = 0.0
+        else:
+            self._buckets[key] = (tokens, now)
+            retry_after = (cost - tokens) / refill_per_second
+        
+        if len(self._buckets) > self.max_keys:
+            self._evict(now, capacity, refill_per_second)
+        return retry_after
+    
+    def _evict(self, now: float, capacity: float, refill_per_second: float) -> None:
+        """Descarta los buckets que ya estarían llenos (equivalen a no tener entrada)"""
+        full_after = capacity / refill_per_second
+        self._buckets = {
+            key: value for key, value in self._buckets.items() if now - value[1] < full_after
+        }
+
+
+class MongoTokenBucketStore(TokenBucketStore):
+    """
+    Buckets compartidos entre instancias en la colección rate_limits de MongoDB
+    El relleno y el consumo se hacen en un único find_one_and_update con pipeline (atómico)
+    Un índice TTL elimina los buckets inactivos
+    """
+    
+    collection_name = "rate_limits"
+    
+    def __init__(self):
+        self._indexes_ready = False
+    
+    def _collection(self):
+        from app.database.database import get_database
+        return get_database()[self.collection_name]
+    
+    async def _ensure_indexes(self, collection) -> None:
+        if not self._indexes_ready:
+            await collection.create_index("expires_at", expireAfterSeconds=0)
+            self._indexes_ready = True
+    
+    async def consume(self, key: str, cost: float, capacity: float, refill_per_second: float) -> float:
+        collection = self._collection()
+        await self._ensure_indexes(collection)
+        
+        now = time.time()
+        refilled = {
+            "$min": [
+                capacity,
+                {"$add": [
+                    {"$ifNull": ["$tokens", capacity]},
+                    {"$multiply": [
+                        {"$subtract": [now, {"$ifNull": ["$updated_at", now]}]},
+                        refill_per_second
+                    ]}
+                ]}
+            ]
+        }
+        pipeline = [
+            {"$set": {"tokens": refilled, "updated_at": now}},
+            {"$set": {"allowed": {"$gte": ["$tokens", cost]}}},
+            {"$set": {
+                "tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", cost]}, "$tokens"]},
+                "expires_at": datetime.utcnow() + timedelta(seconds=capacity / refill_per_second)
+            }},
+        ]
+        bucket = await collection.find_one_and_update(
+            {"_id": key}, pipeline, upsert=True, return_document=ReturnDocument.AFTER
+        )
+        if bucket["allowed"]:
+            return 0.0
+        return (cost - bucket["tokens"]) / refill_per_second
+
+
+class ConcurrencyLimiter:
+    """
+    Límite global de peticiones simultáneas por clase de endpoint
+    Las peticiones que superan el límite esperan en cola hasta queue_timeout segundos
+    """
+    
+    def __init__(self, limits: Dict[str, int], max_queue: int, queue_timeout: float):
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._semaphores = {name: asyncio.Semaphore(limit) for name, limit in limits.items()}
+        self._waiting: Dict[str, int] = {name: 0 for name in limits}
+    
+    async def acquire(self, endpoint_class: str) -> bool:
+        """Retorna True si se obtuvo plaza; False si la cola está llena o se agotó la espera"""
+        semaphore = self._semaphores.get(endpoint_class)
+        if semaphore is None:
+            return True
+        if semaphore.locked() and self._waiting[endpoint_class] >= self.max_queue:
+            return False
+        
+        self._waiting[endpoint_class] += 1
+        try:
+            await asyncio.wait_for(semaphore.acquire(), timeout=self.queue_timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._waiting[endpoint_class] -= 1
+    
+    def release(self, endpoint_class: str) -> None:
+        semaphore = self._semaphores.get(endpoint_class)
+        if semaphore is not None:
+            semaphore.release()
+
+
+def build_token_bucket_store(kind: str) -> TokenBucketStore:
+    """Crea el almacén de contadores configurado ("memory" o "mongo")"""
+    if kind == "memory":
+        return InMemoryTokenBucketStore()
+    if kind == "mongo":
+        return MongoTokenBucketStore()
+    raise ValueError(f"RATE_LIMIT_STORE desconocido: {kind}")
+
+
+class AdmissionControlMiddleware:
+    """
+    Middleware ASGI de control de admisión para los endpoints costosos
+    - Token bucket por usuario (subject del JWT) y por IP, con coste por ruta
+    - Límite global de concurrencia por clase de endpoint con cola de espera
+    - Responde 429 con Retry-After cuando no se admite la petición
+    Las rutas sin regla pasan directamente sin coste adicional
+    """
+    
+    def __init__(
+        self,
+        app,
+        store: Optional[TokenBucketStore] = None,
+        rules: Optional[List[AdmissionRule]] = None,
+        limiter: Optional[ConcurrencyLimiter] = None
+    ):
+        self.app = app
+        self.store = store or build_token_bucket_store(settings.RATE_LIMIT_STORE)
+        self.rules = rules if rules is not None else DEFAULT_RULES
+        self.limiter = limiter or ConcurrencyLimiter(
+            settings.ADMISSION_CONCURRENCY_LIMITS,
+            max_queue=settings.ADMISSION_MAX_QUEUE,
+            queue_timeout=settings.ADMISSION_QUEUE_TIMEOUT_SECONDS
+        )
+    
+    def _match(self, method: str, path: str) -> Optional[AdmissionRule]:
+        for rule in self.rules:
+            if rule.method == method and rule.path.match(path):
+                return rule
+        return None
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        rule = self._match(scope["method"], scope["path"])
+        if rule is None:
+            await self.app(scope, receive, send)
+            return
+        
+        headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope["headers"]}
+        retry_after = await self._consume_buckets(rule, headers, scope)
+        if retry_after > 0:
+            await self._reject(send, retry_after, "Demasiadas peticiones, inténtalo más tarde")
+            return
+        
+        if not await self.limiter.acquire(rule.endpoint_class):
+            await self._reject(send, 1, "Servicio saturado, inténtalo más tarde")
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.limiter.release(rule.endpoint_class)
+    
+    async def _consume_buckets(self, rule: AdmissionRule, headers: Dict[str, str], scope) -> float:
+        """Consume del bucket del usuario (si hay JWT válido) y del de la IP"""
+        retry_after = 0.0
+        
+        authorization = headers.get("authorization", "")
+        if authorization.lower().startswith("bearer "):
+            subject = decode_token_subject(authorization[7:])
+            if subject:
+                retry_after = max(retry_after, await self.store.consume(
+                    f"user:{subject}", rule.cost,
+                    settings.RATE_LIMIT_USER_CAPACITY, settings.RATE_LIMIT_USER_REFILL_PER_SECOND
+                ))
+        
+        ip = self._client_ip(headers, scope)
+        if ip:
+            retry_after = max(retry_after, await self.store.consume(
+                f"ip:{ip}", rule.cost,
+                settings.RATE_LIMIT_IP_CAPACITY, settings.RATE_LIMIT_IP_REFILL_PER_SECOND
+            ))
+        return retry_after
+    
+    @staticmethod
+    def _client_ip(headers: Dict[str, str], scope) -> Optional[str]:
+        """
+        IP del cliente para el bucket por IP
+        Con RATE_LIMIT_TRUST_FORWARDED_FOR se toma la entrada de X-Forwarded-For añadida por el
+        primero de los RATE_LIMIT_TRUSTED_PROXIES proxies de confianza, contando desde la derecha
+        (las entradas de la izquierda las controla el cliente y no sirven para limitar)
+        """
+        forwarded = headers.get("x-forwarded-for")
+        trusted = settings.RATE_LIMIT_TRUSTED_PROXIES
+        if forwarded and settings.RATE_LIMIT_TRUST_FORWARDED_FOR and trusted > 0:
+            entries = [entry.strip() for entry in forwarded.split(",") if entry.strip()]
+            if len(entries) >= trusted:
+                return entries[-trusted]
+        client = scope.get("client")
+        return client[0] if client else None
+    
+    @staticmethod
+    async def _reject(send, retry_after: float, detail: str) -> None:
+        logging.warning(f"Petición rechazada por control de admisión: {detail}")
+        body = json.dumps({"detail": detail}).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode("latin-1")),
+                (b"retry-after", str(max(1, math.ceil(retry_after))).encode("latin-1")),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
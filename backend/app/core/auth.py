@@ -1,7 +1,7 @@
 from typing import Optional
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
-from fastapi import Depends, HTTPException, status, Header
+from fastapi import Depends, HTTPException, status, Header, Query
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from app.core.config import settings
 from app.models.user import User
@@ -23,6 +23,18 @@ async def create_access_token(data: dict, expires_delta: Optional[timedelta] = N
     return encoded_jwt
 
 
+def decode_token_subject(token: str) -> Optional[str]:
+    """
+    Decodifica un token JWT y retorna su subject (email) o None si no es válido
+    No consulta la base de datos (sirve también para middlewares)
+    """
+    try:
+        payload = jwt.decode(token, settings.JWT_SECRET_KEY, algorithms=[settings.JWT_ALGORITHM])
+    except JWTError:
+        return None
+    return payload.get("sub")
+
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> User:
     """
     Obtiene el usuario actual desde el token JWT
@@ -34,13 +46,11 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         headers={"WWW-Authenticate": "Bearer"},
     )
     
-    try:
-        token = credentials.credentials
-        payload = jwt.decode(token, settings.JWT_SECRET_KEY, algorithms=[settings.JWT_ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-    except JWTError:
+    if not credentials:
+        raise credentials_exception
+    
+    email = decode_token_subject(credentials.credentials)
+    if email is None:
         raise credentials_exception
     
     user = await User.find_one(User.email == email)
@@ -58,14 +68,35 @@ async def get_current_user_optional(credentials: Optional[HTTPAuthorizationCrede
     if not credentials:
         return None
     
-    try:
-        token = credentials.credentials
-        payload = jwt.decode(token, settings.JWT_SECRET_KEY, algorithms=[settings.JWT_ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            return None
-    except JWTError:
+    email = decode_token_subject(credentials.credentials)
+    if email is None:
         return None
     
     user = await User.find_one(User.email == email)
     return user
+
+
+async def get_current_user_sse(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(security),
+    access_token: Optional[str] = Query(None)
+) -> User:
+    """
+    Como get_current_user, pero acepta también el token en el query param access_token
+    EventSource del navegador no permite enviar la cabecera Authorization
+    """
+    if credentials is None and access_token:
+        credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=access_token)
+    return await get_current_user(credentials)
+
+
+async def get_current_admin(current_user: User = Depends(get_current_user)) -> User:
+    """
+    Obtiene el usuario actual si es administrador (email en ADMIN_EMAILS)
+    Dependency para las rutas de /admin
+    """
+    if current_user.email not in settings.ADMIN_EMAILS:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Solo los administradores pueden acceder a este recurso"
+        )
+    return current_user
@@ -1,3 +1,4 @@
+from typing import Dict, List, Optional
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
@@ -5,6 +6,13 @@ class Settings(BaseSettings):
     MONGODB_CONNECTION_STRING: str
     MONGODB_DATABASE_NAME: str
     
+    # Enrutado de lecturas en replica set ("primary", "primaryPreferred", "secondary", "secondaryPreferred", "nearest")
+    # max staleness: -1 sin límite; si se indica, MongoDB exige al menos 90 segundos
+    MONGODB_READ_PREFERENCE_PUBLIC: str = "secondaryPreferred"
+    MONGODB_MAX_STALENESS_PUBLIC_SECONDS: int = 90
+    MONGODB_READ_PREFERENCE_ANALYTICS: str = "secondaryPreferred"
+    MONGODB_MAX_STALENESS_ANALYTICS_SECONDS: int = -1
+    
     # JWT Authentication
     JWT_SECRET_KEY: str
     JWT_ALGORITHM: str = "HS256"
@@ -13,6 +21,21 @@ class Settings(BaseSettings):
     GOOGLE_CLIENT_ID: str
     GOOGLE_CLIENT_SECRET: str
     
+    # Geocoding: cadena de proveedores en orden de preferencia ("nominatim", "photon", "gazetteer")
+    # Si un proveedor tarda más que su p95 se lanza en paralelo el siguiente (hedging)
+    GEOCODING_PROVIDERS: List[str] = ["nominatim", "photon", "gazetteer"]
+    NOMINATIM_URL: str = "https://nominatim.openstreetmap.org"
+    PHOTON_URL: str = "https://photon.komoot.io"
+    GEOCODING_TIMEOUT_SECONDS: float = 10.0
+    GEOCODING_HEDGE_DEFAULT_DELAY_SECONDS: float = 1.5  # Hasta tener suficientes muestras de latencia
+    GEOCODING_HEDGE_MIN_DELAY_SECONDS: float = 0.3
+    GEOCODING_HEDGE_MAX_DELAY_SECONDS: float = 3.0
+    GEOCODING_BREAKER_FAILURES: int = 5
+    GEOCODING_BREAKER_COOLDOWN_SECONDS: float = 30.0
+    
+    # Administradores (acceso a /admin, p. ej. perfiles de rendimiento)
+    ADMIN_EMAILS: List[str] = []
+    
     # Frontend URL (para redirección después de OAuth)
     FRONTEND_URL: str = "http://localhost:5173"
     
@@ -20,6 +43,67 @@ class Settings(BaseSettings):
     CLOUDINARY_CLOUD_NAME: str
     CLOUDINARY_API_KEY: str
     CLOUDINARY_API_SECRET: str
+    
+    # Creación asíncrona de marcadores (worker en proceso + colección marker_jobs)
+    MARKER_JOBS_CONCURRENCY: int = 2
+    MARKER_JOBS_MAX_ATTEMPTS: int = 5
+    MARKER_JOBS_RETRY_BASE_SECONDS: float = 2.0
+    MARKER_JOBS_LEASE_SECONDS: float = 60.0
+    MARKER_JOBS_SWEEP_SECONDS: float = 30.0
+    
+    # Búsqueda de usuarios (caché de prefijos calientes)
+    USER_SEARCH_CACHE_SIZE: int = 1024
+    USER_SEARCH_CACHE_TTL_SECONDS: float = 60.0
+    
+    # Control de admisión (token bucket por usuario/IP + concurrencia por clase de endpoint)
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_STORE: str = "memory"  # "memory" (por proceso) o "mongo" (compartido)
+    RATE_LIMIT_USER_CAPACITY: float = 60.0
+    RATE_LIMIT_USER_REFILL_PER_SECOND: float = 1.0
+    RATE_LIMIT_IP_CAPACITY: float = 120.0
+    RATE_LIMIT_IP_REFILL_PER_SECOND: float = 2.0
+    # Solo activar detrás de proxies que añaden X-Forwarded-For (p. ej. Vercel: 1 proxy)
+    RATE_LIMIT_TRUST_FORWARDED_FOR: bool = False
+    RATE_LIMIT_TRUSTED_PROXIES: int = 1
+    ADMISSION_CONCURRENCY_LIMITS: Dict[str, int] = {"geocode": 8, "upload": 4, "public_read": 32, "bulk": 4}
+    ADMISSION_MAX_QUEUE: int = 100
+    ADMISSION_QUEUE_TIMEOUT_SECONDS: float = 5.0
+    
+    # Operaciones en lote sobre marcadores
+    MARKER_BULK_MAX_ITEMS: int = 500
+    MARKER_BULK_GEOCODE_CONCURRENCY: int = 4
+    
+    # Teselas vectoriales (MVT) de marcadores
+    TILE_CACHE_MAX_USERS: int = 500
+    TILE_CACHE_TILES_PER_USER: int = 256
+    TILE_CACHE_TTL_SECONDS: float = 300.0
+    TILE_BROWSER_MAX_AGE_SECONDS: int = 60
+    
+    # Heatmap global (rejillas multirresolución precalculadas)
+    HEATMAP_MAX_LEVEL: int = 5  # Nivel 5 = celdas de ~0,35°
+    HEATMAP_REBUILD_SECONDS: float = 900.0
+    HEATMAP_RELOAD_SECONDS: float = 300.0
+    HEATMAP_BATCH_SIZE: int = 10000
+    
+    # Gazetteer local para autocompletado de lugares (por defecto app/data/gazetteer.tsv)
+    # Acepta también volcados de GeoNames, p. ej. cities15000.txt
+    GAZETTEER_PATH: Optional[str] = None
+    
+    # Actualizaciones en vivo por Server-Sent Events
+    EVENT_BUS_BACKEND: str = "memory"  # "memory" (por proceso) o "mongo_change_streams" (requiere replica set)
+    EVENT_SUBSCRIBER_QUEUE_SIZE: int = 100
+    EVENT_MAX_SUBSCRIBERS_PER_TOPIC: int = 200
+    EVENT_HEARTBEAT_SECONDS: float = 15.0
+    
+    # Perfilado bajo demanda de peticiones (desactivado por defecto)
+    # Se perfila con la cabecera "X-Profile: <PROFILING_TOKEN>" o al azar con PROFILING_SAMPLE_RATE
+    PROFILING_ENABLED: bool = False
+    PROFILING_TOKEN: Optional[str] = None
+    PROFILING_SAMPLE_RATE: float = 0.0
+    PROFILING_INTERVAL_MS: float = 5.0
+    PROFILING_MAX_SAMPLES: int = 20000
+    PROFILING_MAX_PROFILES: int = 50
+    PROFILING_MAX_CONCURRENT: int = 2
 
     class Config:
         env_file = ".env"
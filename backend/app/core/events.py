@@ -0,0 +1,270 @@
+import asyncio
+import itertools
+import json
+import logging
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, List, Optional, Set
+from app.core.config import settings
+
+
+@dataclass
+class Event:
+    """Evento publicado en un topic (p. ej. "markers:user@example.com")"""
+    topic: str
+    type: str
+    data: Dict[str, Any]
+    id: int = 0
+    
+    def to_sse(self) -> str:
+        """Formato Server-Sent Events"""
+        return f"id: {self.id}\nevent: {self.type}\ndata: {json.dumps(self.data, default=str)}\n\n"
+
+
+@dataclass(eq=False)
+class Subscription:
+    """
+    Suscripción a un topic con cola acotada
+    Si el cliente no consume a tiempo se descartan los eventos más antiguos
+    """
+    topic: str
+    queue: asyncio.Queue
+    dropped: int = field(default=0)
+    
+    def put(self, event: Event) -> None:
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+
+
+class TooManySubscribersError(Exception):
+    """Se alcanzó el máximo de suscriptores para un topic"""
+
+
+class EventBackend(ABC):
+    """
+    Transporte de eventos entre las rutas de escritura y el bus
+    - publish(): lo llaman MarkerCRUD/VisitCRUD tras cada escritura
+    - start()/stop(): para backends que necesitan tareas en segundo plano
+    """
+    
+    def __init__(self):
+        self.bus: Optional["EventBus"] = None
+    
+    @abstractmethod
+    def publish(self, topic: str, event_type: str, data: Dict[str, Any]) -> None:
+        ...
+    
+    async def start(self) -> None:
+        pass
+    
+    async def stop(self) -> None:
+        pass
+
+
+class InProcessEventBackend(EventBackend):
+    """Entrega directa a los suscriptores del mismo proceso"""
+    
+    def publish(self, topic: str, event_type: str, data: Dict[str, Any]) -> None:
+        self.bus.dispatch(topic, event_type, data)
+
+
+class MongoChangeStreamBackend(EventBackend):
+    """
+    Eventos a partir de change streams de MongoDB (requiere replica set)
+    Las escrituras de cualquier instancia llegan a los suscriptores de todas,
+    así que publish() no hace nada: el propio cambio en la colección es el evento
+    Para los borrados se usan las pre-images (changeStreamPreAndPostImages en markers)
+    """
+    
+    def __init__(self):
+        super().__init__()
+        self._tasks: List[asyncio.Task] = []
+    
+    def publish(self, topic: str, event_type: str, data: Dict[str, Any]) -> None:
+        pass
+    
+    async def start(self) -> None:
+        from app.models.marker import Marker
+        from app.models.visit import Visit
+        self._tasks = [
+            asyncio.create_task(self._watch(Marker.get_motor_collection(), self._marker_event)),
+            asyncio.create_task(self._watch(Visit.get_motor_collection(), self._visit_event)),
+        ]
+    
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+    
+    async def _watch(self, collection, mapper) -> None:
+        while True:
+            try:
+                async with collection.watch(
+                    full_document="updateLookup",
+                    full_document_before_change="whenAvailable"
+                ) as stream:
+                    async for change in stream:
+                        routed = mapper(change)
+                        if routed:
+                            self.bus.dispatch(*routed)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Error en change stream de {collection.name}: {str(e)}")
+                await asyncio.sleep(5)
+    
+    @staticmethod
+    def _marker_event(change: dict):
+        from app.models.marker import Marker
+        operation = change["operationType"]
+        if operation == "delete":
+            before = change.get("fullDocumentBeforeChange")
+            if not before:
+                return None
+            return f"markers:{before['user_email']}", "marker.deleted", {"id": str(before["_id"])}
+        
+        doc = change.get("fullDocument")
+        if not doc:
+            return None
+        marker = Marker.model_validate(doc)
+        if operation == "insert":
+            event_type = "marker.pending" if marker.status == "pending" else "marker.created"
+        elif marker.status in ("pending", "failed"):
+            # Pendientes y fallidos solo los ve el propietario (no están en los eventos públicos)
+            event_type = f"marker.{marker.status}"
+        elif MongoChangeStreamBackend._became_ready(change):
+            event_type = "marker.ready"
+        else:
+            event_type = "marker.updated"
+        return f"markers:{marker.user_email}", event_type, marker_event_data(marker)
+    
+    @staticmethod
+    def _became_ready(change: dict) -> bool:
+        """
+        Indica si la actualización pasó el marcador a ready (igual que marker.ready del backend en proceso)
+        Con la imagen previa se compara el estado anterior; sin ella, si la actualización cambió status
+        """
+        before = change.get("fullDocumentBeforeChange")
+        if before is not None:
+            return before.get("status", "ready") != "ready"
+        updated = (change.get("updateDescription") or {}).get("updatedFields") or {}
+        return "status" in updated
+    
+    @staticmethod
+    def _visit_event(change: dict):
+        from app.models.visit import Visit
+        if change["operationType"] != "insert":
+            return None
+        visit = Visit.model_validate(change["fullDocument"])
+        return f"visits:{visit.visited_user_email}", "visit.created", visit_event_data(visit)
+
+
+class EventBus:
+    """
+    Bus pub/sub en proceso para notificar cambios a los clientes por SSE
+    La memoria está acotada: max_queue eventos por suscriptor y max_subscribers por topic
+    """
+    
+    def __init__(self, backend: EventBackend, max_queue: int, max_subscribers: int):
+        self.backend = backend
+        self.backend.bus = self
+        self.max_queue = max_queue
+        self.max_subscribers = max_subscribers
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+        self._ids = itertools.count(1)
+    
+    def publish(self, topic: str, event_type: str, data: Dict[str, Any]) -> None:
+        """Publica un evento (no bloquea; los suscriptores lentos pierden los más antiguos)"""
+        try:
+            self.backend.publish(topic, event_type, data)
+        except Exception as e:
+            logging.error(f"Error publicando evento {event_type}: {str(e)}")
+    
+    def dispatch(self, topic: str, event_type: str, data: Dict[str, Any]) -> None:
+        """Entrega un evento a los suscriptores locales del topic"""
+        subscribers = self._subscribers.get(topic)
+        if not subscribers:
+            return
+        event = Event(topic=topic, type=event_type, data=data, id=next(self._ids))
+        for subscription in subscribers:
+            subscription.put(event)
+    
+    def subscribe(self, topic: str) -> Subscription:
+        subscribers = self._subscribers.setdefault(topic, set())
+        if len(subscribers) >= self.max_subscribers:
+            raise TooManySubscribersError(topic)
+        subscription = Subscription(topic=topic, queue=asyncio.Queue(maxsize=self.max_queue))
+        subscribers.add(subscription)
+        return subscription
+    
+    def unsubscribe(self, subscription: Subscription) -> None:
+        subscribers = self._subscribers.get(subscription.topic)
+        if subscribers is None:
+            return
+        subscribers.discard(subscription)
+        if not subscribers:
+            del self._subscribers[subscription.topic]
+    
+    async def stream(
+        self,
+        subscription: Subscription,
+        is_disconnected,
+        heartbeat_seconds: float,
+        event_types: Optional[Set[str]] = None
+    ) -> AsyncIterator[str]:
+        """
+        Genera el flujo SSE de una suscripción con comentarios de keep-alive
+        event_types limita los tipos de evento que se envían (None = todos)
+        Se da de baja al desconectarse el cliente
+        """
+        try:
+            yield "retry: 5000\n\n"
+            while not await is_disconnected():
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), timeout=heartbeat_seconds)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                if event_types is None or event.type in event_types:
+                    yield event.to_sse()
+        finally:
+            self.unsubscribe(subscription)
+    
+    async def start(self) -> None:
+        await self.backend.start()
+    
+    async def stop(self) -> None:
+        await self.backend.stop()
+
+
+def marker_event_data(marker) -> Dict[str, Any]:
+    """Serializa un marcador para un evento (mismo formato que las respuestas de la API)"""
+    data = marker.model_dump(mode="json", by_alias=True)
+    data["id"] = str(marker.id)
+    return data
+
+
+def visit_event_data(visit) -> Dict[str, Any]:
+    """Serializa una visita para un evento (mismo formato que /visits/my-visits)"""
+    data = visit.model_dump(mode="json", by_alias=True)
+    data["id"] = str(visit.id)
+    return data
+
+
+def build_event_backend(kind: str) -> EventBackend:
+    """Crea el backend de eventos configurado ("memory" o "mongo_change_streams")"""
+    if kind == "memory":
+        return InProcessEventBackend()
+    if kind == "mongo_change_streams":
+        return MongoChangeStreamBackend()
+    raise ValueError(f"EVENT_BUS_BACKEND desconocido: {kind}")
+
+
+event_bus = EventBus(
+    backend=build_event_backend(settings.EVENT_BUS_BACKEND),
+    max_queue=settings.EVENT_SUBSCRIBER_QUEUE_SIZE,
+    max_subscribers=settings.EVENT_MAX_SUBSCRIBERS_PER_TOPIC
+)
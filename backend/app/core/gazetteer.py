@@ -0,0 +1,155 @@
+import heapq
+import logging
+from bisect import bisect_left
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional
+from app.core.config import settings
+from app.core.utils import normalize_text
+
+# Gazetteer incluido en el repositorio (países y ciudades principales)
+DEFAULT_GAZETTEER_PATH = Path(__file__).resolve().parent.parent / "data" / "gazetteer.tsv"
+
+# Prefijos de hasta esta longitud tienen el top precalculado (los rangos más grandes)
+_PRECOMPUTED_PREFIX_LENGTH = 2
+MAX_RESULTS = 20
+
+
+@dataclass(frozen=True)
+class Place:
+    """Lugar del gazetteer con sus coordenadas y población (para ordenar resultados)"""
+    id: str
+    name: str
+    country_code: str
+    country: str
+    latitude: float
+    longitude: float
+    population: int
+    kind: str  # "country" o "city"
+    
+    @property
+    def display_name(self) -> str:
+        """Nombre para mostrar y guardar como location_name ("Paris, France")"""
+        if self.kind == "country" or not self.country:
+            return self.name
+        return f"{self.name}, {self.country}"
+    
+    def to_dict(self) -> dict:
+        return {
+            "place_id": self.id,
+            "name": self.name,
+            "display_name": self.display_name,
+            "country": self.country,
+            "country_code": self.country_code,
+            "latitude": self.latitude,
+            "longitude": self.longitude,
+            "population": self.population,
+            "kind": self.kind
+        }
+
+
+def _parse_line(columns: List[str]) -> Optional[Place]:
+    """
+    Interpreta una línea del gazetteer propio (8 columnas) o de un volcado de GeoNames
+    (cities15000.txt, allCountries.txt...: 19 columnas separadas por tabulador)
+    """
+    if len(columns) == 8:
+        place_id, name, country_code, country, lat, lon, population, kind = columns
+        return Place(place_id, name, country_code, country, float(lat), float(lon), int(population), kind)
+    if len(columns) >= 19:
+        return Place(
+            id=f"gn{columns[0]}",
+            name=columns[1],
+            country_code=columns[8],
+            country=columns[8],
+            latitude=float(columns[4]),
+            longitude=float(columns[5]),
+            population=int(columns[14] or 0),
+            kind="city"
+        )
+    return None
+
+
+class PlaceIndex:
+    """
+    Índice de prefijos compacto sobre el gazetteer
+    - Arrays ordenados de claves normalizadas: un prefijo es un rango [lo, hi) por bisección
+    - Se indexan el nombre y el nombre con país; la normalización quita acentos ("cordoba" encuentra "Córdoba")
+    - Los resultados se ordenan por población; para prefijos cortos el top está precalculado
+    """
+    
+    def __init__(self, places: List[Place]):
+        self.places = places
+        self.by_id: Dict[str, int] = {place.id: i for i, place in enumerate(places)}
+        
+        entries = sorted({
+            (key, i)
+            for i, place in enumerate(places)
+            for key in (normalize_text(place.name), normalize_text(place.display_name))
+            if key
+        })
+        self._keys = [key for key, _ in entries]
+        self._place_ids = [i for _, i in entries]
+        
+        self._top_by_prefix: Dict[str, List[int]] = {}
+        for key in set(k[:length] for k in self._keys for length in range(1, _PRECOMPUTED_PREFIX_LENGTH + 1)):
+            self._top_by_prefix[key] = self._top_in_range(key, MAX_RESULTS)
+    
+    @classmethod
+    def from_file(cls, path: Path) -> "PlaceIndex":
+        places = []
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("#") or not line.strip():
+                    continue
+                try:
+                    place = _parse_line(line.rstrip("\n").split("\t"))
+                except ValueError:
+                    continue
+                if place:
+                    places.append(place)
+        logging.info(f"Gazetteer cargado desde {path}: {len(places)} lugares")
+        return cls(places)
+    
+    def _top_in_range(self, prefix: str, limit: int, country: str = "") -> List[int]:
+        lo = bisect_left(self._keys, prefix)
+        hi = bisect_left(self._keys, prefix + "\uffff")
+        candidates = set(self._place_ids[lo:hi])
+        if country:
+            candidates = {
+                i for i in candidates
+                if normalize_text(self.places[i].country).startswith(country)
+                or normalize_text(self.places[i].country_code) == country
+            }
+        return heapq.nlargest(limit, candidates, key=lambda i: self.places[i].population)
+    
+    def autocomplete(self, query: str, limit: int = 10) -> List[Place]:
+        """
+        Lugares cuyo nombre empieza por query, de mayor a menor población
+        "paris, fr" filtra además por país (nombre o código)
+        """
+        name_part, _, country_part = query.partition(",")
+        prefix = normalize_text(name_part)
+        country = normalize_text(country_part)
+        if not prefix:
+            return []
+        
+        limit = min(limit, MAX_RESULTS)
+        if not country and prefix in self._top_by_prefix:
+            ids = self._top_by_prefix[prefix][:limit]
+        else:
+            ids = self._top_in_range(prefix, limit, country)
+        return [self.places[i] for i in ids]
+    
+    def get(self, place_id: str) -> Optional[Place]:
+        """Obtiene un lugar por su ID (el place_id devuelto por autocomplete)"""
+        i = self.by_id.get(place_id)
+        return self.places[i] if i is not None else None
+
+
+@lru_cache(maxsize=1)
+def get_place_index() -> PlaceIndex:
+    """Índice del gazetteer configurado (GAZETTEER_PATH) cargado una sola vez por proceso"""
+    path = Path(settings.GAZETTEER_PATH) if settings.GAZETTEER_PATH else DEFAULT_GAZETTEER_PATH
+    return PlaceIndex.from_file(path)
@@ -0,0 +1,21 @@
+from typing import Sequence
+import numpy as np
+
+# Radio medio de la Tierra (IUGG) en kilómetros
+EARTH_RADIUS_KM = 6371.0088
+
+
+def path_length_km(latitudes: Sequence[float], longitudes: Sequence[float]) -> float:
+    """
+    Longitud total en kilómetros del recorrido que une los puntos en orden
+    Fórmula de haversine vectorizada sobre arrays de coordenadas
+    """
+    lat = np.radians(np.asarray(latitudes, dtype=np.float64))
+    lon = np.radians(np.asarray(longitudes, dtype=np.float64))
+    if lat.size < 2:
+        return 0.0
+    
+    dphi = np.diff(lat)
+    dlambda = np.diff(lon)
+    a = np.sin(dphi / 2) ** 2 + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(dlambda / 2) ** 2
+    return float(np.sum(2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(1.0, np.sqrt(a)))))
@@ -1,57 +1,335 @@
+import asyncio
 import httpx
-from typing import Optional, Tuple
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Dict, List, Optional, Tuple
 import logging
+from app.core.config import settings
+from app.core.gazetteer import get_place_index
+from app.core.utils import normalize_text
+
+Coordinates = Tuple[float, float]
+
+# Nominatim y Photon requieren un User-Agent identificable
+USER_AGENT = "MiMapa/1.0"
+
+
+class GeocodingError(Exception):
+    """Fallo del proveedor (timeout, error HTTP, respuesta inválida), distinto de "no encontrado" """
+
+
+class GeocoderProvider(ABC):
+    """
+    Proveedor de geocoding
+    geocode() retorna (latitud, longitud), None si el lugar no existe
+    o lanza GeocodingError si el proveedor falla
+    """
+    
+    name = "base"
+    
+    @abstractmethod
+    async def geocode(self, location_name: str) -> Optional[Coordinates]:
+        ...
+
+
+class NominatimProvider(GeocoderProvider):
+    """
+    Nominatim (OpenStreetMap), la instancia pública u otra propia
+    Documentación: https://nominatim.org/release-docs/develop/api/Search/
+    """
+    
+    name = "nominatim"
+    
+    def __init__(self, base_url: str, timeout: float):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+    
+    async def geocode(self, location_name: str) -> Optional[Coordinates]:
+        params = {
+            "q": location_name,
+            "format": "json",
+            "limit": 1,
+            "addressdetails": 1
+        }
+        try:
+            async with httpx.AsyncClient() as client:
+                response = await client.get(
+                    f"{self.base_url}/search", params=params,
+                    headers={"User-Agent": USER_AGENT}, timeout=self.timeout
+                )
+                response.raise_for_status()
+                results = response.json()
+                if not results:
+                    return None
+                return float(results[0]["lat"]), float(results[0]["lon"])
+        except httpx.HTTPError as e:
+            raise GeocodingError(f"Error HTTP: {str(e) or e.__class__.__name__}")
+        except (KeyError, ValueError, TypeError) as e:
+            raise GeocodingError(f"Respuesta inválida: {str(e)}")
+
+
+class PhotonProvider(GeocoderProvider):
+    """
+    Photon (komoot), autoalojable sobre datos de OpenStreetMap
+    Documentación: https://github.com/komoot/photon
+    """
+    
+    name = "photon"
+    
+    def __init__(self, base_url: str, timeout: float):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+    
+    async def geocode(self, location_name: str) -> Optional[Coordinates]:
+        try:
+            async with httpx.AsyncClient() as client:
+                response = await client.get(
+                    f"{self.base_url}/api", params={"q": location_name, "limit": 1},
+                    headers={"User-Agent": USER_AGENT}, timeout=self.timeout
+                )
+                response.raise_for_status()
+                features = response.json().get("features") or []
+                if not features:
+                    return None
+                # GeoJSON: [longitud, latitud]
+                longitude, latitude = features[0]["geometry"]["coordinates"][:2]
+                return float(latitude), float(longitude)
+        except httpx.HTTPError as e:
+            raise GeocodingError(f"Error HTTP: {str(e) or e.__class__.__name__}")
+        except (KeyError, IndexError, ValueError, TypeError) as e:
+            raise GeocodingError(f"Respuesta inválida: {str(e)}")
+
+
+class GazetteerProvider(GeocoderProvider):
+    """
+    Gazetteer local (el mismo de /places/autocomplete), sin red
+    Solo acepta coincidencias exactas del nombre ("Paris" o "Paris, France"), no prefijos
+    """
+    
+    name = "gazetteer"
+    
+    async def geocode(self, location_name: str) -> Optional[Coordinates]:
+        name = normalize_text(location_name.partition(",")[0])
+        for place in get_place_index().autocomplete(location_name, limit=5):
+            if normalize_text(place.name) == name:
+                return place.latitude, place.longitude
+        return None
+
+
+class ProviderHealth:
+    """
+    Salud de un proveedor: latencias recientes (para el p95) y circuit breaker
+    - Tras failure_threshold fallos seguidos el circuito se abre durante cooldown segundos
+      (cuentan también las peticiones canceladas que ya superaban el p95)
+    - Pasado ese tiempo se deja pasar una única petición de prueba (semiabierto):
+      si funciona se cierra el circuito, si falla se vuelve a abrir
+    """
+    
+    def __init__(self, failure_threshold: int, cooldown: float, window: int = 100):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.latencies: deque = deque(maxlen=window)
+        self.consecutive_failures = 0
+        self.successes = 0
+        self.failures = 0
+        self.slow = 0  # Cancelaciones por superar el p95
+        self.opened_until = 0.0
+        self._trial_in_flight = False
+    
+    @property
+    def state(self) -> str:
+        if self.consecutive_failures < self.failure_threshold:
+            return "closed"
+        return "half_open" if time.monotonic() >= self.opened_until else "open"
+    
+    def acquire(self) -> bool:
+        """Indica si se puede usar el proveedor ahora (reserva la petición de prueba si está semiabierto)"""
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+    
+    def record_success(self, latency: float) -> None:
+        self.latencies.append(latency)
+        self.successes += 1
+        self.consecutive_failures = 0
+        self._trial_in_flight = False
+    
+    def record_failure(self) -> None:
+        self.failures += 1
+        self.consecutive_failures += 1
+        self._trial_in_flight = False
+        if self.consecutive_failures >= self.failure_threshold:
+            self.opened_until = time.monotonic() + self.cooldown
+    
+    def record_cancelled(self, elapsed: float) -> None:
+        """
+        Petición cancelada sin resultado (p. ej. ganó la de cobertura): elapsed es una cota inferior
+        de su latencia. Si ya supera el p95 se registra como muestra y cuenta como lenta para el
+        circuit breaker: un proveedor que se vuelve lento sube su p95 y acaba abriendo el circuito
+        en lugar de recibir primero todas las peticiones. Las cancelaciones más rápidas que el p95
+        no aportan información y se ignoran (sesgarían el p95 a la baja)
+        """
+        self._trial_in_flight = False
+        current = self.percentile(0.95)
+        if current is None or elapsed < current:
+            return
+        self.latencies.append(elapsed)
+        self.slow += 1
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= self.failure_threshold:
+            self.opened_until = time.monotonic() + self.cooldown
+    
+    def percentile(self, fraction: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+    
+    def to_dict(self) -> dict:
+        p50, p95 = self.percentile(0.5), self.percentile(0.95)
+        return {
+            "state": self.state,
+            "successes": self.successes,
+            "failures": self.failures,
+            "slow": self.slow,
+            "consecutive_failures": self.consecutive_failures,
+            "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None
+        }
+
+
+class GeocoderChain:
+    """
+    Cadena de proveedores con peticiones de cobertura (hedging) y failover
+    - Se empieza por el primer proveedor disponible (circuito no abierto)
+    - Si no responde dentro de su p95 (acotado entre hedge_min y hedge_max)
+      se lanza en paralelo el siguiente; gana la primera respuesta con coordenadas
+    - Si un proveedor falla o no encuentra el lugar se pasa al siguiente sin esperar
+    """
+    
+    def __init__(
+        self,
+        providers: List[GeocoderProvider],
+        hedge_min_delay: float,
+        hedge_max_delay: float,
+        hedge_default_delay: float,
+        failure_threshold: int,
+        cooldown: float,
+        min_samples: int = 20
+    ):
+        self.providers = providers
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_max_delay = hedge_max_delay
+        self.hedge_default_delay = hedge_default_delay
+        self.min_samples = min_samples
+        self.health: Dict[str, ProviderHealth] = {
+            provider.name: ProviderHealth(failure_threshold, cooldown) for provider in providers
+        }
+    
+    def hedge_delay(self, provider: GeocoderProvider) -> float:
+        """Espera antes de lanzar el siguiente proveedor: p95 de las latencias recientes"""
+        health = self.health[provider.name]
+        p95 = health.percentile(0.95) if len(health.latencies) >= self.min_samples else None
+        if p95 is None:
+            return self.hedge_default_delay
+        return min(self.hedge_max_delay, max(self.hedge_min_delay, p95))
+    
+    async def _call(self, provider: GeocoderProvider, location_name: str) -> Optional[Coordinates]:
+        """Llama a un proveedor registrando su latencia y resultado"""
+        health = self.health[provider.name]
+        start = time.monotonic()
+        try:
+            coordinates = await provider.geocode(location_name)
+        except asyncio.CancelledError:
+            health.record_cancelled(time.monotonic() - start)
+            raise
+        except Exception as e:
+            health.record_failure()
+            logging.warning(f"Geocoding con {provider.name} fallido para '{location_name}': {str(e)}")
+            raise
+        health.record_success(time.monotonic() - start)
+        return coordinates
+    
+    async def geocode(self, location_name: str) -> Optional[Coordinates]:
+        remaining = list(self.providers)
+        running: Dict[asyncio.Task, GeocoderProvider] = {}
+        
+        def launch_next() -> Optional[GeocoderProvider]:
+            while remaining:
+                provider = remaining.pop(0)
+                if self.health[provider.name].acquire():
+                    running[asyncio.create_task(self._call(provider, location_name))] = provider
+                    return provider
+            return None
+        
+        last = launch_next()
+        try:
+            while running:
+                timeout = self.hedge_delay(last) if remaining else None
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # El proveedor más reciente tarda más que su p95: petición de cobertura
+                    last = launch_next() or last
+                    continue
+                
+                for task in done:
+                    provider = running.pop(task)
+                    if not task.cancelled() and task.exception() is None and task.result():
+                        latitude, longitude = task.result()
+                        logging.info(f"Geocodificado '{location_name}' con {provider.name}: ({latitude}, {longitude})")
+                        return latitude, longitude
+                    # Falló o no encontró el lugar: siguiente proveedor sin esperar
+                    last = launch_next() or last
+        finally:
+            for task in running:
+                task.cancel()
+        
+        logging.warning(f"No se encontraron coordenadas para: {location_name}")
+        return None
+    
+    def status(self) -> Dict[str, dict]:
+        return {name: health.to_dict() for name, health in self.health.items()}
+
+
+def build_provider(name: str) -> GeocoderProvider:
+    """Crea un proveedor por nombre ("nominatim", "photon" o "gazetteer")"""
+    if name == "nominatim":
+        return NominatimProvider(settings.NOMINATIM_URL, settings.GEOCODING_TIMEOUT_SECONDS)
+    if name == "photon":
+        return PhotonProvider(settings.PHOTON_URL, settings.GEOCODING_TIMEOUT_SECONDS)
+    if name == "gazetteer":
+        return GazetteerProvider()
+    raise ValueError(f"Proveedor de geocoding desconocido: {name}")
+
+
+geocoder = GeocoderChain(
+    providers=[build_provider(name) for name in settings.GEOCODING_PROVIDERS],
+    hedge_min_delay=settings.GEOCODING_HEDGE_MIN_DELAY_SECONDS,
+    hedge_max_delay=settings.GEOCODING_HEDGE_MAX_DELAY_SECONDS,
+    hedge_default_delay=settings.GEOCODING_HEDGE_DEFAULT_DELAY_SECONDS,
+    failure_threshold=settings.GEOCODING_BREAKER_FAILURES,
+    cooldown=settings.GEOCODING_BREAKER_COOLDOWN_SECONDS
+)
 
 
 async def geocode_location(location_name: str) -> Optional[Tuple[float, float]]:
     """
-    Obtiene las coordenadas (latitud, longitud) de una ubicación usando Nominatim (OpenStreetMap)
+    Obtiene las coordenadas (latitud, longitud) de una ubicación
+    Usa la cadena de proveedores configurada en GEOCODING_PROVIDERS (hedging + failover)
     
     Args:
         location_name: Nombre del país o ciudad a geocodificar
-        
+    
     Returns:
         Tupla (latitud, longitud) o None si no se encuentra
     """
-    # Usar Nominatim (OpenStreetMap) - servicio gratuito
-    # Documentación: https://nominatim.org/release-docs/develop/api/Search/
-    url = "https://nominatim.openstreetmap.org/search"
-    
-    params = {
-        "q": location_name,
-        "format": "json",
-        "limit": 1,
-        "addressdetails": 1
-    }
-    
-    headers = {
-        "User-Agent": "MiMapa/1.0"  # Nominatim requiere un User-Agent
-    }
-    
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, params=params, headers=headers, timeout=10.0)
-            response.raise_for_status()
-            
-            results = response.json()
-            
-            if not results or len(results) == 0:
-                logging.warning(f"No se encontraron coordenadas para: {location_name}")
-                return None
-            
-            result = results[0]
-            latitude = float(result['lat'])
-            longitude = float(result['lon'])
-            
-            logging.info(f"Geocodificado '{location_name}': ({latitude}, {longitude})")
-            return (latitude, longitude)
-            
-    except httpx.HTTPError as e:
-        logging.error(f"Error HTTP en geocoding para '{location_name}': {str(e)}")
-        return None
-    except (KeyError, ValueError) as e:
-        logging.error(f"Error al parsear respuesta de geocoding: {str(e)}")
-        return None
+        return await geocoder.geocode(location_name)
     except Exception as e:
         logging.error(f"Error inesperado en geocoding: {str(e)}")
         return None
@@ -64,11 +342,11 @@ async def reverse_geocode(latitude: float, longitude: float) -> Optional[str]:
     Args:
         latitude: Latitud
         longitude: Longitud
-        
+    
     Returns:
         Nombre de la ubicación o None si no se encuentra
     """
-    url = "https://nominatim.openstreetmap.org/reverse"
+    url = f"{settings.NOMINATIM_URL.rstrip('/')}/reverse"
     
     params = {
         "lat": latitude,
@@ -78,7 +356,7 @@ async def reverse_geocode(latitude: float, longitude: float) -> Optional[str]:
     }
     
     headers = {
-        "User-Agent": "MiMapa/1.0"
+        "User-Agent": USER_AGENT
     }
     
     try:
@@ -92,7 +370,7 @@ async def reverse_geocode(latitude: float, longitude: float) -> Optional[str]:
                 return result['display_name']
             
             return None
-            
+    
     except Exception as e:
         logging.error(f"Error en reverse geocoding: {str(e)}")
         return None
@@ -0,0 +1,196 @@
+import asyncio
+import logging
+import time
+import zlib
+from datetime import datetime
+from typing import Dict, List, Optional
+import numpy as np
+from app.core.config import settings
+from app.models.heatmap_grid import HeatmapGrid
+from app.models.marker import Marker, UNREADY_STATUSES
+
+# Nivel 0: celdas de 11,25° (32x16); cada nivel duplica la resolución
+BASE_WIDTH = 32
+BASE_HEIGHT = 16
+
+
+def grid_shape(level: int) -> tuple:
+    """(alto, ancho) de la rejilla de un nivel"""
+    return BASE_HEIGHT * 2 ** level, BASE_WIDTH * 2 ** level
+
+
+def histogram_finest(latitudes: np.ndarray, longitudes: np.ndarray, max_level: int) -> np.ndarray:
+    """Conteo vectorizado de coordenadas en la rejilla del nivel más fino"""
+    height, width = grid_shape(max_level)
+    counts, _, _ = np.histogram2d(
+        latitudes, longitudes,
+        bins=[height, width],
+        range=[[-90.0, 90.0], [-180.0, 180.0]]
+    )
+    return counts.astype(np.uint32)
+
+
+def build_pyramid(finest: np.ndarray, max_level: int) -> Dict[int, np.ndarray]:
+    """Genera los niveles más gruesos sumando bloques de 2x2 del nivel inmediatamente más fino"""
+    grids = {max_level: finest}
+    for level in range(max_level - 1, -1, -1):
+        child = grids[level + 1]
+        height, width = child.shape
+        grids[level] = child.reshape(height // 2, 2, width // 2, 2).sum(axis=(1, 3), dtype=np.uint32)
+    return grids
+
+
+class HeatmapService:
+    """
+    Mapa de calor global a partir de rejillas multirresolución precalculadas
+    - rebuild(): recorre las coordenadas de todos los marcadores por lotes y guarda las rejillas
+    - query(): responde cualquier zoom/viewport recortando la rejilla en memoria, con coste
+      independiente del número total de marcadores
+    - Un bucle periódico reconstruye las rejillas cuando superan HEATMAP_REBUILD_SECONDS
+    """
+    
+    def __init__(self, max_level: int, rebuild_seconds: float, reload_seconds: float, batch_size: int):
+        self.max_level = max_level
+        self.rebuild_seconds = rebuild_seconds
+        self.reload_seconds = reload_seconds
+        self.batch_size = batch_size
+        self._grids: Dict[int, np.ndarray] = {}
+        self._built_at: Optional[datetime] = None
+        self._loaded_at = 0.0
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+    
+    async def rebuild(self) -> Dict[int, np.ndarray]:
+        """Recalcula y persiste todas las rejillas"""
+        height, width = grid_shape(self.max_level)
+        finest = np.zeros((height, width), dtype=np.uint32)
+        
+        cursor = Marker.get_motor_collection().find(
+            {"status": {"$nin": UNREADY_STATUSES}, "latitude": {"$ne": None}},
+            {"_id": 0, "latitude": 1, "longitude": 1}
+        ).batch_size(self.batch_size)
+        batch: List[dict] = []
+        async for doc in cursor:
+            batch.append(doc)
+            if len(batch) >= self.batch_size:
+                finest += self._histogram_batch(batch)
+                batch = []
+        if batch:
+            finest += self._histogram_batch(batch)
+        
+        grids = build_pyramid(finest, self.max_level)
+        built_at = datetime.utcnow()
+        total = int(finest.sum())
+        for level, grid in grids.items():
+            fields = {
+                "width": grid.shape[1],
+                "height": grid.shape[0],
+                "counts": zlib.compress(grid.astype("<u4").tobytes()),
+                "total": total,
+                "built_at": built_at
+            }
+            # Un único update_one con upsert: con el índice único no puede haber niveles repetidos
+            await HeatmapGrid.get_motor_collection().update_one(
+                {"level": level}, {"$set": fields}, upsert=True
+            )
+        
+        self._grids, self._built_at, self._loaded_at = grids, built_at, time.monotonic()
+        logging.info(f"Heatmap reconstruido: {total} marcadores, {len(grids)} niveles")
+        return grids
+    
+    def _histogram_batch(self, batch: List[dict]) -> np.ndarray:
+        latitudes = np.fromiter((d["latitude"] for d in batch), dtype=np.float64, count=len(batch))
+        longitudes = np.fromiter((d["longitude"] for d in batch), dtype=np.float64, count=len(batch))
+        return histogram_finest(latitudes, longitudes, self.max_level)
+    
+    async def _load(self) -> None:
+        """Carga las rejillas guardadas; si falta algún nivel las construye"""
+        levels = list(range(self.max_level + 1))
+        docs = {doc.level: doc for doc in await HeatmapGrid.find({"level": {"$in": levels}}).to_list()}
+        if any(level not in docs for level in levels):
+            await self.rebuild()
+            return
+        self._grids = {
+            level: np.frombuffer(zlib.decompress(doc.counts), dtype="<u4").reshape(doc.height, doc.width)
+            for level, doc in docs.items()
+        }
+        self._built_at = min(doc.built_at for doc in docs.values())
+        self._loaded_at = time.monotonic()
+    
+    async def _ensure_loaded(self) -> None:
+        if self._grids and time.monotonic() - self._loaded_at < self.reload_seconds:
+            return
+        async with self._lock:
+            if not self._grids or time.monotonic() - self._loaded_at >= self.reload_seconds:
+                await self._load()
+    
+    async def query(self, zoom: int, south: float, west: float, north: float, east: float) -> dict:
+        """
+        Celdas con marcadores dentro del viewport para el nivel que corresponde al zoom
+        Si west > east el viewport cruza el antimeridiano
+        """
+        await self._ensure_loaded()
+        level = max(0, min(self.max_level, zoom))
+        grid = self._grids[level]
+        height, width = grid.shape
+        cell_lat = 180.0 / height
+        cell_lon = 360.0 / width
+        
+        row_start = int(np.clip(np.floor((south + 90.0) / cell_lat), 0, height - 1))
+        row_end = int(np.clip(np.floor((north + 90.0) / cell_lat), 0, height - 1)) + 1
+        col_west = int(np.clip(np.floor((west + 180.0) / cell_lon), 0, width - 1))
+        col_east = int(np.clip(np.floor((east + 180.0) / cell_lon), 0, width - 1))
+        if col_west <= col_east:
+            cols = np.arange(col_west, col_east + 1)
+        else:
+            cols = np.concatenate([np.arange(col_west, width), np.arange(0, col_east + 1)])
+        
+        window = grid[row_start:row_end][:, cols]
+        rows_idx, cols_idx = np.nonzero(window)
+        counts = window[rows_idx, cols_idx]
+        latitudes = -90.0 + (rows_idx + row_start + 0.5) * cell_lat
+        longitudes = -180.0 + (cols[cols_idx] + 0.5) * cell_lon
+        
+        return {
+            "level": level,
+            "cell_size_deg": [cell_lat, cell_lon],
+            "built_at": self._built_at,
+            "max_count": int(counts.max()) if counts.size else 0,
+            # [latitud, longitud, conteo] del centro de cada celda no vacía
+            "cells": [
+                [round(float(lat), 5), round(float(lon), 5), int(count)]
+                for lat, lon, count in zip(latitudes, longitudes, counts)
+            ]
+        }
+    
+    async def start(self) -> None:
+        """Arranca la reconstrucción periódica"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._periodic_rebuild())
+    
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+    
+    async def _periodic_rebuild(self) -> None:
+        while True:
+            try:
+                # Otra instancia puede haberlas reconstruido hace poco
+                latest = await HeatmapGrid.find_one(HeatmapGrid.level == 0)
+                age = (datetime.utcnow() - latest.built_at).total_seconds() if latest else None
+                if age is None or age >= self.rebuild_seconds:
+                    async with self._lock:
+                        await self.rebuild()
+            except Exception as e:
+                logging.error(f"Error reconstruyendo el heatmap: {str(e)}")
+            await asyncio.sleep(self.rebuild_seconds)
+
+
+heatmap_service = HeatmapService(
+    max_level=settings.HEATMAP_MAX_LEVEL,
+    rebuild_seconds=settings.HEATMAP_REBUILD_SECONDS,
+    reload_seconds=settings.HEATMAP_RELOAD_SECONDS,
+    batch_size=settings.HEATMAP_BATCH_SIZE
+)
@@ -0,0 +1,51 @@
+import asyncio
+import logging
+import cloudinary
+import cloudinary.uploader
+from fastapi import HTTPException, UploadFile, status
+from app.core.config import settings
+
+# Configurar Cloudinary (obligatorio)
+cloudinary.config(
+    cloud_name=settings.CLOUDINARY_CLOUD_NAME,
+    api_key=settings.CLOUDINARY_API_KEY,
+    api_secret=settings.CLOUDINARY_API_SECRET
+)
+
+
+def is_data_url(image_url: str) -> bool:
+    """Indica si la imagen viene como base64 (data URL) y debe subirse a Cloudinary"""
+    return image_url.startswith('data:image')
+
+
+async def upload_data_url(image_url: str) -> str:
+    """
+    Sube una imagen base64 (data URL) a Cloudinary y retorna la URL segura
+    El SDK de Cloudinary es síncrono, así que se ejecuta en un hilo aparte
+    Propaga la excepción original para que el llamador decida cómo reportarla
+    """
+    result = await asyncio.to_thread(cloudinary.uploader.upload, image_url, folder="mimapa")
+    return result['secure_url']
+
+
+async def upload_image_to_cloudinary(file: UploadFile) -> str:
+    """Sube una imagen a Cloudinary y retorna la URL"""
+    try:
+        # Leer el contenido del archivo
+        contents = await file.read()
+        
+        # Subir a Cloudinary
+        result = await asyncio.to_thread(
+            cloudinary.uploader.upload,
+            contents,
+            folder="mimapa",
+            resource_type="image"
+        )
+        
+        return result['secure_url']
+    except Exception as e:
+        logging.error(f"Error subiendo imagen a Cloudinary: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Error al subir la imagen"
+        )
@@ -0,0 +1,168 @@
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import msgpack
+
+# Tipos MIME del formato compacto (columnas + coordenadas en polyline)
+COLUMNAR_JSON_MEDIA_TYPE = "application/vnd.mimapa.map+json"
+COLUMNAR_MSGPACK_MEDIA_TYPE = "application/vnd.mimapa.map+msgpack"
+COLUMNAR_FORMAT_VERSION = "columnar-v1"
+
+# Precisión de la polyline: 5 decimales (~1 m), la del algoritmo estándar de Google
+POLYLINE_PRECISION = 5
+
+# Valores del query param ?format= (tienen prioridad sobre la cabecera Accept)
+_FORMAT_ALIASES = {
+    "json": "json",
+    "columnar": "columnar",
+    "msgpack": "msgpack",
+}
+_MEDIA_TYPES = {
+    "application/json": "json",
+    COLUMNAR_JSON_MEDIA_TYPE: "columnar",
+    COLUMNAR_MSGPACK_MEDIA_TYPE: "msgpack",
+    "application/msgpack": "msgpack",
+    "application/x-msgpack": "msgpack",
+}
+
+
+def negotiate_map_format(accept: Optional[str], requested: Optional[str] = None) -> str:
+    """
+    Elige el formato de respuesta del mapa: "json" (por defecto), "columnar" o "msgpack"
+    requested (?format=) manda sobre Accept; en Accept se respeta el parámetro q
+    """
+    if requested:
+        return _FORMAT_ALIASES.get(requested.lower(), "json")
+    if not accept:
+        return "json"
+    
+    best, best_q = "json", 0.0
+    for part in accept.split(","):
+        media_type, *params = [p.strip() for p in part.split(";")]
+        fmt = _MEDIA_TYPES.get(media_type.lower())
+        if fmt is None:
+            continue
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        # A igual q gana el primero que aparece
+        if q > best_q:
+            best, best_q = fmt, q
+    return best
+
+
+def encode_polyline(coordinates: Sequence[Tuple[float, float]], precision: int = POLYLINE_PRECISION) -> str:
+    """Codifica (latitud, longitud) con el algoritmo de polyline de Google (deltas + varint en ASCII)"""
+    factor = 10 ** precision
+    out = []
+    prev_lat = prev_lon = 0
+    for latitude, longitude in coordinates:
+        lat = int(round(latitude * factor))
+        lon = int(round(longitude * factor))
+        for delta in (lat - prev_lat, lon - prev_lon):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                out.append(chr((0x20 | (value & 0x1F)) + 63))
+                value >>= 5
+            out.append(chr(value + 63))
+        prev_lat, prev_lon = lat, lon
+    return "".join(out)
+
+
+def decode_polyline(encoded: str, precision: int = POLYLINE_PRECISION) -> List[Tuple[float, float]]:
+    """Inversa de encode_polyline"""
+    factor = 10 ** precision
+    coordinates = []
+    index = lat = lon = 0
+    length = len(encoded)
+    while index < length:
+        deltas = []
+        for _ in range(2):
+            result = shift = 0
+            while True:
+                byte = ord(encoded[index]) - 63
+                index += 1
+                result |= (byte & 0x1F) << shift
+                shift += 5
+                if byte < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lon += deltas[1]
+        coordinates.append((lat / factor, lon / factor))
+    return coordinates
+
+
+def _delta_encode(values: List[int]) -> List[int]:
+    """Primer valor absoluto y después diferencias con el anterior"""
+    return [value - previous for value, previous in zip(values, [0] + values[:-1])]
+
+
+def _delta_decode(deltas: List[int]) -> List[int]:
+    values, total = [], 0
+    for delta in deltas:
+        total += delta
+        values.append(total)
+    return values
+
+
+def build_columnar_map(user_email: str, user_name: Optional[str], markers: List[Any]) -> Dict[str, Any]:
+    """
+    Representación compacta del mapa de un usuario
+    - El propietario aparece una sola vez (no en cada marcador)
+    - Un array por campo en lugar de un objeto por marcador (las claves no se repiten)
+    - Coordenadas en una polyline y created_at en segundos con codificación delta,
+      ordenando los marcadores por fecha de creación
+    """
+    markers = sorted(markers, key=lambda m: m.created_at)
+    created = [
+        int(m.created_at.replace(tzinfo=m.created_at.tzinfo or timezone.utc).timestamp())
+        for m in markers
+    ]
+    return {
+        "format": COLUMNAR_FORMAT_VERSION,
+        "user_email": user_email,
+        "user_name": user_name,
+        "count": len(markers),
+        "id": [str(m.id) for m in markers],
+        "location_name": [m.location_name for m in markers],
+        "coordinates": encode_polyline([(m.latitude, m.longitude) for m in markers]),
+        "created_at": _delta_encode(created),
+        "image_url": [m.image_url for m in markers],
+        "description": [m.description for m in markers],
+        "version": [m.version for m in markers],
+    }
+
+
+def decode_columnar_map(payload: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Reconstruye la lista de marcadores (formato de la respuesta JSON) a partir del formato columnar
+    Referencia para los clientes y para el benchmark
+    """
+    coordinates = decode_polyline(payload["coordinates"])
+    created = _delta_decode(payload["created_at"])
+    return [
+        {
+            "id": payload["id"][i],
+            "user_email": payload["user_email"],
+            "location_name": payload["location_name"][i],
+            "latitude": coordinates[i][0],
+            "longitude": coordinates[i][1],
+            "image_url": payload["image_url"][i],
+            "description": payload["description"][i],
+            "created_at": datetime.fromtimestamp(created[i], tz=timezone.utc).replace(tzinfo=None).isoformat(),
+            "version": payload["version"][i],
+        }
+        for i in range(payload["count"])
+    ]
+
+
+def pack_msgpack(payload: Dict[str, Any]) -> bytes:
+    return msgpack.packb(payload, use_bin_type=True)
+
+
+def unpack_msgpack(data: bytes) -> Dict[str, Any]:
+    return msgpack.unpackb(data, raw=False)
@@ -0,0 +1,155 @@
+import asyncio
+import logging
+from typing import List, Optional
+from beanie import PydanticObjectId
+from app.core.config import settings
+from app.core.geocoding import geocode_location
+from app.core.images import upload_data_url
+from app.crud.marker_crud import MarkerCRUD
+from app.crud.marker_job_crud import MarkerJobCRUD
+from app.models.marker_job import MarkerJob
+
+
+class MarkerJobError(Exception):
+    """Error al procesar un trabajo de creación de marcador"""
+
+
+class MarkerJobCancelled(Exception):
+    """El trabajo se eliminó junto con su marcador mientras se procesaba"""
+
+
+class MarkerJobWorker:
+    """
+    Worker en proceso para la creación asíncrona de marcadores
+    - Cola en memoria (asyncio.Queue) para despachar los trabajos recién creados sin esperas
+    - La colección marker_jobs da durabilidad: un barrido periódico recupera trabajos
+      pendientes de reintento o cuyo worker murió (lease expirado)
+    - Cada trabajo se reclama de forma atómica, así que varias instancias pueden convivir
+    """
+    
+    def __init__(
+        self,
+        concurrency: int,
+        max_attempts: int,
+        retry_base_seconds: float,
+        lease_seconds: float,
+        sweep_seconds: float
+    ):
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.retry_base_seconds = retry_base_seconds
+        self.lease_seconds = lease_seconds
+        self.sweep_seconds = sweep_seconds
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+    
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+    
+    async def start(self) -> None:
+        """Arranca los consumidores y el barrido de trabajos persistidos"""
+        if self.running:
+            return
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._consume()) for _ in range(self.concurrency)]
+        self._tasks.append(asyncio.create_task(self._sweep()))
+        logging.info(f"Worker de marcadores iniciado ({self.concurrency} consumidores)")
+    
+    async def stop(self) -> None:
+        """Detiene el worker; los trabajos en curso se recuperarán al expirar su lease"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+    
+    def enqueue(self, job_id: PydanticObjectId) -> None:
+        """Despacha un trabajo al worker (si no está en marcha lo recogerá el barrido)"""
+        if self._queue is not None:
+            self._queue.put_nowait(job_id)
+    
+    def _enqueue_later(self, job_id: PydanticObjectId, delay: float) -> None:
+        if self._queue is not None:
+            asyncio.get_running_loop().call_later(delay, self.enqueue, job_id)
+    
+    async def _sweep(self) -> None:
+        while True:
+            try:
+                for job_id in await MarkerJobCRUD.get_claimable_job_ids():
+                    self.enqueue(job_id)
+            except Exception as e:
+                logging.error(f"Error recuperando trabajos de marcadores: {str(e)}")
+            await asyncio.sleep(self.sweep_seconds)
+    
+    async def _consume(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self.process(job_id)
+            except Exception as e:
+                logging.error(f"Error inesperado procesando el trabajo {job_id}: {str(e)}")
+            finally:
+                self._queue.task_done()
+    
+    async def process(self, job_id: PydanticObjectId) -> None:
+        """Procesa un trabajo: geocoding, subida de imagen y paso del marcador a ready"""
+        job = await MarkerJobCRUD.claim_job(job_id, self.lease_seconds)
+        if not job:
+            # Otro worker lo tiene, ya terminó o aún no toca reintentarlo
+            return
+        
+        try:
+            await self._run_steps(job)
+        except MarkerJobCancelled:
+            logging.info(f"Trabajo {job.id} cancelado: su marcador {job.marker_id} se eliminó")
+            return
+        except Exception as e:
+            await self._handle_failure(job, str(e) or e.__class__.__name__)
+            return
+        
+        await MarkerJobCRUD.delete_job(job.id)
+        logging.info(f"Marcador {job.marker_id} completado tras {job.attempts} intento(s)")
+    
+    async def _run_steps(self, job: MarkerJob) -> None:
+        if job.latitude is None or job.longitude is None:
+            coordinates = await geocode_location(job.location_name)
+            if not coordinates:
+                raise MarkerJobError(f"No se pudieron encontrar coordenadas para: {job.location_name}")
+            job.latitude, job.longitude = coordinates
+            await MarkerJobCRUD.save_progress(job.id, {"latitude": job.latitude, "longitude": job.longitude})
+        
+        if job.image_data:
+            # No subir a Cloudinary la imagen de un marcador que ya se eliminó
+            if not await MarkerJobCRUD.job_exists(job.id):
+                raise MarkerJobCancelled()
+            try:
+                job.image_url = await upload_data_url(job.image_data)
+            except Exception as e:
+                raise MarkerJobError(f"Error al procesar la imagen: {str(e)}")
+            job.image_data = None
+            await MarkerJobCRUD.save_progress(job.id, {"image_url": job.image_url, "image_data": None})
+        
+        await MarkerCRUD.complete_pending_marker(job.marker_id, job.latitude, job.longitude, job.image_url)
+    
+    async def _handle_failure(self, job: MarkerJob, error: str) -> None:
+        if job.attempts >= self.max_attempts:
+            logging.error(f"Trabajo {job.id} fallido definitivamente: {error}")
+            await MarkerJobCRUD.mark_failed(job.id, error)
+            await MarkerCRUD.fail_pending_marker(job.marker_id, error)
+            return
+        
+        # Backoff exponencial: base, 2*base, 4*base...
+        delay = self.retry_base_seconds * (2 ** (job.attempts - 1))
+        logging.warning(f"Trabajo {job.id} fallido (intento {job.attempts}), reintento en {delay}s: {error}")
+        await MarkerJobCRUD.schedule_retry(job.id, delay, error)
+        self._enqueue_later(job.id, delay)
+
+
+marker_job_worker = MarkerJobWorker(
+    concurrency=settings.MARKER_JOBS_CONCURRENCY,
+    max_attempts=settings.MARKER_JOBS_MAX_ATTEMPTS,
+    retry_base_seconds=settings.MARKER_JOBS_RETRY_BASE_SECONDS,
+    lease_seconds=settings.MARKER_JOBS_LEASE_SECONDS,
+    sweep_seconds=settings.MARKER_JOBS_SWEEP_SECONDS
+)
@@ -0,0 +1,209 @@
+import hmac
+import logging
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from app.core.config import settings
+
+# Frame de speedscope: (función, fichero, línea)
+FrameKey = Tuple[str, str, int]
+
+
+class StackSampler:
+    """
+    Perfilador estadístico: un hilo aparte toma cada interval segundos la pila del hilo objetivo
+    (el del event loop) mediante sys._current_frames()
+    No instala hooks de trazado, así que el coste para el código perfilado es mínimo
+    Al compartir el event loop, las muestras incluyen también lo que hagan otras peticiones concurrentes
+    """
+    
+    def __init__(self, thread_id: int, interval: float, max_samples: int):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.max_samples = max_samples
+        self.frames: List[FrameKey] = []
+        self.samples: List[List[int]] = []
+        self.weights: List[float] = []
+        self._frame_index: Dict[FrameKey, int] = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler-sampler", daemon=True)
+    
+    def start(self) -> None:
+        self._thread.start()
+    
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+    
+    def _run(self) -> None:
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval) and len(self.samples) < self.max_samples:
+            now = time.perf_counter()
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.samples.append(self._stack(frame))
+                self.weights.append((now - last) * 1000)
+            last = now
+    
+    def _stack(self, frame) -> List[int]:
+        """Índices de frames desde la raíz hasta la función en ejecución"""
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            key = (code.co_name, code.co_filename, frame.f_lineno)
+            index = self._frame_index.get(key)
+            if index is None:
+                index = self._frame_index[key] = len(self.frames)
+                self.frames.append(key)
+            stack.append(index)
+            frame = frame.f_back
+        stack.reverse()
+        return stack
+
+
+@dataclass
+class Profile:
+    """Perfil capturado de una petición"""
+    method: str
+    path: str
+    trigger: str  # "header" o "sampling"
+    started_at: datetime
+    duration_ms: float
+    status_code: Optional[int]
+    frames: List[FrameKey]
+    samples: List[List[int]]
+    weights: List[float]
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "trigger": self.trigger,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration_ms, 2),
+            "status_code": self.status_code,
+            "samples": len(self.samples)
+        }
+    
+    def to_speedscope(self) -> dict:
+        """Perfil en el formato de https://www.speedscope.app (tipo "sampled")"""
+        name = f"{self.method} {self.path}"
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {
+                "frames": [{"name": n, "file": f, "line": line} for n, f, line in self.frames]
+            },
+            "profiles": [{
+                "type": "sampled",
+                "name": name,
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": self.duration_ms,
+                "samples": self.samples,
+                "weights": self.weights
+            }],
+            "name": name,
+            "exporter": "mimapa-backend"
+        }
+
+
+class ProfileStore:
+    """Últimos perfiles capturados (deque acotado: los más antiguos se descartan)"""
+    
+    def __init__(self, max_profiles: int):
+        self._profiles: deque = deque(maxlen=max_profiles)
+    
+    def add(self, profile: Profile) -> None:
+        self._profiles.append(profile)
+    
+    def list(self) -> List[Profile]:
+        return list(reversed(self._profiles))
+    
+    def get(self, profile_id: str) -> Optional[Profile]:
+        for profile in self._profiles:
+            if profile.id == profile_id:
+                return profile
+        return None
+
+
+profile_store = ProfileStore(max_profiles=settings.PROFILING_MAX_PROFILES)
+
+
+class ProfilingMiddleware:
+    """
+    Middleware ASGI de perfilado bajo demanda
+    - Cabecera X-Profile con el valor de PROFILING_TOKEN: perfila esa petición
+    - PROFILING_SAMPLE_RATE: fracción de peticiones perfiladas al azar
+    Solo se registra si PROFILING_ENABLED; las peticiones no elegidas pasan sin coste adicional
+    """
+    
+    header_name = b"x-profile"
+    
+    def __init__(self, app, store: Optional[ProfileStore] = None):
+        self.app = app
+        self.store = store or profile_store
+        self._active = 0
+    
+    def _trigger(self, scope) -> Optional[str]:
+        if settings.PROFILING_TOKEN:
+            for key, value in scope["headers"]:
+                if key == self.header_name:
+                    if hmac.compare_digest(value, settings.PROFILING_TOKEN.encode("latin-1")):
+                        return "header"
+                    break
+        if settings.PROFILING_SAMPLE_RATE > 0 and random.random() < settings.PROFILING_SAMPLE_RATE:
+            return "sampling"
+        return None
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        trigger = self._trigger(scope)
+        if trigger is None or self._active >= settings.PROFILING_MAX_CONCURRENT:
+            await self.app(scope, receive, send)
+            return
+        
+        status_code: Optional[int] = None
+        
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+        
+        sampler = StackSampler(
+            threading.get_ident(),
+            interval=settings.PROFILING_INTERVAL_MS / 1000,
+            max_samples=settings.PROFILING_MAX_SAMPLES
+        )
+        self._active += 1
+        started_at = datetime.utcnow()
+        start = time.perf_counter()
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            sampler.stop()
+            self._active -= 1
+            self.store.add(Profile(
+                method=scope["method"],
+                path=scope["path"],
+                trigger=trigger,
+                started_at=started_at,
+                duration_ms=(time.perf_counter() - start) * 1000,
+                status_code=status_code,
+                frames=sampler.frames,
+                samples=sampler.samples,
+                weights=sampler.weights
+            ))
+            logging.info(f"Perfil capturado para {scope['method']} {scope['path']} ({len(sampler.samples)} muestras)")
@@ -1,3 +1,4 @@
+import unicodedata
 from bson import ObjectId
 from fastapi import HTTPException, status
 
@@ -7,3 +8,10 @@ def ensure_object_id(value: str, *, field: str = "id") -> None:
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"{field} no es un ObjectId válido",
         )
+
+
+def normalize_text(value: str) -> str:
+    """Normaliza texto para búsquedas: minúsculas, sin acentos y sin espacios sobrantes"""
+    decomposed = unicodedata.normalize("NFKD", value)
+    without_accents = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return " ".join(without_accents.lower().split())
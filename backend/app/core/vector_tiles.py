@@ -0,0 +1,172 @@
+import math
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+from app.core.cache import TTLCache
+from app.core.config import settings
+
+# Resolución interna de la tesela (estándar de Mapbox Vector Tiles)
+TILE_EXTENT = 4096
+# Margen alrededor de la tesela para que los iconos en el borde no se corten
+TILE_BUFFER = 64
+MAX_ZOOM = 22
+
+# Tipos de geometría y comandos de la especificación MVT 2.1
+_GEOM_POINT = 1
+_CMD_MOVE_TO = 1
+
+# Límite de latitud de la proyección Web Mercator
+_MAX_LATITUDE = 85.0511287798
+
+
+def is_valid_tile(z: int, x: int, y: int) -> bool:
+    """Indica si las coordenadas z/x/y corresponden a una tesela existente"""
+    return 0 <= z <= MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def _tile_fraction(latitude: float, longitude: float, z: int) -> Tuple[float, float]:
+    """Posición (en unidades de tesela, con decimales) de un punto en el nivel z"""
+    n = 2 ** z
+    lat = math.radians(max(-_MAX_LATITUDE, min(_MAX_LATITUDE, latitude)))
+    tx = (longitude + 180.0) / 360.0 * n
+    ty = (1.0 - math.asinh(math.tan(lat)) / math.pi) / 2.0 * n
+    return tx, ty
+
+
+def _tile_corner(z: int, x: float, y: float) -> Tuple[float, float]:
+    """Latitud y longitud de la esquina superior izquierda de la tesela x/y"""
+    n = 2 ** z
+    longitude = x / n * 360.0 - 180.0
+    latitude = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    return latitude, longitude
+
+
+def tile_bounds(z: int, x: int, y: int) -> Tuple[float, float, float, float]:
+    """
+    Límites (sur, oeste, norte, este) de la tesela incluyendo el margen TILE_BUFFER
+    Sirven para filtrar en MongoDB los marcadores que pueden aparecer en ella
+    """
+    margin = TILE_BUFFER / TILE_EXTENT
+    north, west = _tile_corner(z, x - margin, y - margin)
+    south, east = _tile_corner(z, x + 1 + margin, y + 1 + margin)
+    return south, max(-180.0, west), north, min(180.0, east)
+
+
+# --- Codificación protobuf mínima (solo lo necesario para capas de puntos) ---
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _zigzag(value: int) -> int:
+    return (value << 1) ^ (value >> 63)
+
+
+def _key(field: int, wire_type: int) -> bytes:
+    return _varint((field << 3) | wire_type)
+
+
+def _length_delimited(field: int, payload: bytes) -> bytes:
+    return _key(field, 2) + _varint(len(payload)) + payload
+
+
+def _packed(field: int, values: Iterable[int]) -> bytes:
+    return _length_delimited(field, b"".join(_varint(v) for v in values))
+
+
+def encode_point_layer(
+    name: str,
+    points: List[Tuple[float, float, Dict[str, str]]],
+    z: int,
+    x: int,
+    y: int
+) -> bytes:
+    """
+    Codifica una tesela MVT con una capa de puntos
+    points: lista de (latitud, longitud, propiedades de texto)
+    Los puntos fuera de la tesela (más el margen) se descartan
+    """
+    keys: Dict[str, int] = {}
+    values: Dict[str, int] = {}
+    features = []
+    
+    for latitude, longitude, properties in points:
+        tx, ty = _tile_fraction(latitude, longitude, z)
+        px = int(round((tx - x) * TILE_EXTENT))
+        py = int(round((ty - y) * TILE_EXTENT))
+        if not (-TILE_BUFFER <= px <= TILE_EXTENT + TILE_BUFFER and -TILE_BUFFER <= py <= TILE_EXTENT + TILE_BUFFER):
+            continue
+        
+        tags = []
+        for prop_key, prop_value in properties.items():
+            if prop_value is None:
+                continue
+            tags.append(keys.setdefault(prop_key, len(keys)))
+            tags.append(values.setdefault(prop_value, len(values)))
+        
+        feature = (
+            _key(1, 0) + _varint(len(features) + 1)
+            + _packed(2, tags)
+            + _key(3, 0) + _varint(_GEOM_POINT)
+            + _packed(4, [(_CMD_MOVE_TO & 0x7) | (1 << 3), _zigzag(px), _zigzag(py)])
+        )
+        features.append(_length_delimited(2, feature))
+    
+    layer = (
+        _key(15, 0) + _varint(2)
+        + _length_delimited(1, name.encode("utf-8"))
+        + b"".join(features)
+        + b"".join(_length_delimited(3, k.encode("utf-8")) for k in keys)
+        + b"".join(_length_delimited(4, _length_delimited(1, v.encode("utf-8"))) for v in values)
+        + _key(5, 0) + _varint(TILE_EXTENT)
+    )
+    return _length_delimited(3, layer)
+
+
+class TileCache:
+    """
+    Caché de teselas codificadas agrupada por usuario
+    invalidate_user() descarta todas las teselas de un usuario cuando cambian sus marcadores
+    Solo se mantienen los max_users usuarios usados más recientemente
+    """
+    
+    def __init__(self, max_users: int, tiles_per_user: int, ttl_seconds: float):
+        self.max_users = max_users
+        self.tiles_per_user = tiles_per_user
+        self.ttl_seconds = ttl_seconds
+        self._users: "OrderedDict[str, TTLCache]" = OrderedDict()
+    
+    def get(self, user_email: str, z: int, x: int, y: int) -> Optional[bytes]:
+        tiles = self._users.get(user_email)
+        if tiles is None:
+            return None
+        self._users.move_to_end(user_email)
+        return tiles.get((z, x, y))
+    
+    def set(self, user_email: str, z: int, x: int, y: int, tile: bytes) -> None:
+        tiles = self._users.get(user_email)
+        if tiles is None:
+            tiles = TTLCache(maxsize=self.tiles_per_user, ttl_seconds=self.ttl_seconds)
+            self._users[user_email] = tiles
+        self._users.move_to_end(user_email)
+        tiles.set((z, x, y), tile)
+        while len(self._users) > self.max_users:
+            self._users.popitem(last=False)
+    
+    def invalidate_user(self, user_email: str) -> None:
+        self._users.pop(user_email, None)
+
+
+# Teselas de marcadores por usuario; MarkerCRUD la invalida al modificar marcadores
+marker_tile_cache = TileCache(
+    max_users=settings.TILE_CACHE_MAX_USERS,
+    tiles_per_user=settings.TILE_CACHE_TILES_PER_USER,
+    ttl_seconds=settings.TILE_CACHE_TTL_SECONDS
+)
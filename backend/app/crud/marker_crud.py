@@ -1,7 +1,32 @@
-from app.models.marker import Marker
+from app.models.marker import Marker, UNREADY_STATUSES
+from app.crud.stats_crud import StatsCRUD
+from app.crud.marker_job_crud import MarkerJobCRUD
+from app.database.database import collection_for
+from app.core.vector_tiles import marker_tile_cache
+from app.core.events import event_bus, marker_event_data
 from pydantic import EmailStr
-from typing import List, Optional
-from beanie import PydanticObjectId
+from typing import Any, Dict, List, Optional, Tuple
+from pymongo import UpdateOne
+import re
+from beanie import PydanticObjectId, UpdateResponse
+from bson import ObjectId
+from beanie.operators import Inc, Set
+
+
+def _owner_filter(
+    marker_id: PydanticObjectId,
+    user_email: EmailStr,
+    expected_version: Optional[int] = None
+) -> Dict[str, Any]:
+    """
+    Filtro que limita la operación al marcador del propietario
+    Si se indica expected_version, solo coincide si la versión no ha cambiado
+    """
+    query: Dict[str, Any] = {"_id": marker_id, "user_email": user_email}
+    if expected_version is not None:
+        # Los marcadores anteriores al campo version no lo tienen almacenado
+        query["version"] = {"$in": [0, None]} if expected_version == 0 else expected_version
+    return query
 
 
 class MarkerCRUD:
@@ -18,7 +43,9 @@ class MarkerCRUD:
         image_url: Optional[str] = None,
         description: Optional[str] = None
     ) -> Marker:
-        """Crea un nuevo marcador para el usuario"""
+        """
+        Crea un nuevo marcador para el usuario
+        """
         marker = Marker(
             user_email=user_email,
             location_name=location_name,
@@ -28,13 +55,116 @@ class MarkerCRUD:
             description=description
         )
         await marker.insert()
+        await StatsCRUD.on_marker_added(marker)
+        marker_tile_cache.invalidate_user(user_email)
+        event_bus.publish(f"markers:{user_email}", "marker.created", marker_event_data(marker))
+        return marker
+    
+    @staticmethod
+    async def create_pending_marker(
+        user_email: EmailStr,
+        location_name: str,
+        description: Optional[str] = None
+    ) -> Marker:
+        """
+        Crea un marcador en estado pendiente (sin coordenadas ni imagen definitiva)
+        Un MarkerJob completará el marcador en segundo plano
+        """
+        marker = Marker(
+            user_email=user_email,
+            location_name=location_name,
+            description=description,
+            status="pending"
+        )
+        await marker.insert()
+        event_bus.publish(f"markers:{user_email}", "marker.pending", marker_event_data(marker))
+        return marker
+    
+    @staticmethod
+    async def complete_pending_marker(
+        marker_id: PydanticObjectId,
+        latitude: float,
+        longitude: float,
+        image_url: Optional[str] = None
+    ) -> Optional[Marker]:
+        """
+        Marca como listo un marcador pendiente con sus coordenadas e imagen
+        Solo se escribe la imagen si el trabajo subió una (no se borra la que ya tuviera)
+        """
+        fields: Dict[str, Any] = {
+            "latitude": latitude,
+            "longitude": longitude,
+            "status": "ready",
+            "processing_error": None
+        }
+        if image_url is not None:
+            fields["image_url"] = image_url
+        marker = await Marker.find_one({"_id": marker_id, "status": "pending"}).update(
+            Set(fields),
+            Inc({Marker.version: 1}),
+            response_type=UpdateResponse.NEW_DOCUMENT
+        )
+        if marker:
+            await StatsCRUD.on_marker_added(marker)
+            marker_tile_cache.invalidate_user(marker.user_email)
+            event_bus.publish(f"markers:{marker.user_email}", "marker.ready", marker_event_data(marker))
         return marker
     
     @staticmethod
-    async def get_user_markers(user_email: EmailStr) -> List[Marker]:
-        """Obtiene todos los marcadores de un usuario"""
-        markers = await Marker.find(Marker.user_email == user_email).to_list()
-        return markers
+    async def fail_pending_marker(marker_id: PydanticObjectId, error: str) -> Optional[Marker]:
+        """Marca como fallido un marcador pendiente que agotó sus reintentos"""
+        marker = await Marker.find_one({"_id": marker_id, "status": "pending"}).update(
+            Set({"status": "failed", "processing_error": error}),
+            Inc({Marker.version: 1}),
+            response_type=UpdateResponse.NEW_DOCUMENT
+        )
+        if marker:
+            event_bus.publish(f"markers:{marker.user_email}", "marker.failed", marker_event_data(marker))
+        return marker
+    
+    @staticmethod
+    async def get_user_markers(
+        user_email: EmailStr,
+        include_pending: bool = False,
+        query_class: str = "primary"
+    ) -> List[Marker]:
+        """
+        Obtiene todos los marcadores de un usuario
+        Por defecto solo los listos (los pendientes/fallidos aún no tienen coordenadas)
+        query_class decide a qué miembro del replica set se envía la lectura
+        ("primary" para el propietario, "public" para mapas de otros usuarios)
+        """
+        filters: Dict[str, Any] = {"user_email": user_email}
+        if not include_pending:
+            filters["status"] = {"$nin": UNREADY_STATUSES}
+        docs = await collection_for(Marker, query_class).find(filters).to_list(length=None)
+        return [Marker.model_validate(doc) for doc in docs]
+    
+    @staticmethod
+    async def get_markers_in_bounds(
+        user_email: EmailStr,
+        south: float,
+        west: float,
+        north: float,
+        east: float,
+        query_class: str = "primary"
+    ) -> List[Dict[str, Any]]:
+        """
+        Obtiene los marcadores listos del usuario dentro de un rectángulo de coordenadas
+        Solo proyecta los campos que se incluyen en las teselas
+        Por defecto lee del primario: el resultado se cachea hasta la siguiente invalidación,
+        y un secundario retrasado dejaría en caché una tesela anterior a la escritura que la invalidó
+        """
+        cursor = collection_for(Marker, query_class).find(
+            {
+                "user_email": user_email,
+                "status": {"$nin": UNREADY_STATUSES},
+                "latitude": {"$gte": south, "$lte": north},
+                "longitude": {"$gte": west, "$lte": east}
+            },
+            {"location_name": 1, "latitude": 1, "longitude": 1, "image_url": 1}
+        )
+        return await cursor.to_list(length=None)
     
     @staticmethod
     async def get_marker_by_id(marker_id: PydanticObjectId) -> Optional[Marker]:
@@ -45,16 +175,61 @@ class MarkerCRUD:
     @staticmethod
     async def delete_marker(marker_id: PydanticObjectId, user_email: EmailStr) -> bool:
         """
-        Elimina un marcador si pertenece al usuario
+        Elimina un marcador si pertenece al usuario (un solo find_one_and_delete filtrado por propietario)
+        Si aún estaba pendiente o fallido también se elimina su trabajo de creación asíncrona
         Retorna True si se eliminó, False si no existe o no pertenece al usuario
         """
-        marker = await Marker.get(marker_id)
-        if not marker or marker.user_email != user_email:
+        deleted = await Marker.get_motor_collection().find_one_and_delete(
+            _owner_filter(marker_id, user_email)
+        )
+        if not deleted:
             return False
         
-        await marker.delete()
+        if deleted.get("status") in UNREADY_STATUSES:
+            await MarkerJobCRUD.delete_jobs_for_markers([marker_id])
+        await StatsCRUD.on_marker_removed(Marker.model_validate(deleted))
+        marker_tile_cache.invalidate_user(user_email)
+        event_bus.publish(f"markers:{user_email}", "marker.deleted", {"id": str(marker_id)})
         return True
     
+    @staticmethod
+    async def update_marker(
+        marker_id: PydanticObjectId,
+        user_email: EmailStr,
+        fields: Dict[str, Any],
+        expected_version: Optional[int] = None
+    ) -> Optional[Marker]:
+        """
+        Actualiza de forma atómica solo los campos indicados ($set) e incrementa la versión
+        Retorna el marcador actualizado o None si no existe, no pertenece al usuario,
+        su versión no coincide con expected_version o aún está pendiente
+        (el trabajo de creación asíncrona sobrescribiría los cambios)
+        Si trae coordenadas, un marcador fallido pasa a ready
+        """
+        if "latitude" in fields:
+            fields = {**fields, "status": "ready", "processing_error": None}
+        operators = [Inc({Marker.version: 1})]
+        if fields:
+            operators.insert(0, Set(fields))
+        query = _owner_filter(marker_id, user_email, expected_version)
+        query["status"] = {"$ne": "pending"}
+        # Se pide el documento previo para saber si el cambio afecta a las estadísticas
+        old = await Marker.find_one(query).update(*operators, response_type=UpdateResponse.OLD_DOCUMENT)
+        if not old:
+            return None
+        
+        marker = old.model_copy(update={**fields, "version": old.version + 1})
+        marker_tile_cache.invalidate_user(user_email)
+        if old.status == "failed" and marker.status == "ready":
+            # Corregido a mano tras fallar la creación asíncrona: entra ahora en el mapa
+            await MarkerJobCRUD.delete_jobs_for_markers([marker_id])
+            await StatsCRUD.on_marker_added(marker)
+            event_bus.publish(f"markers:{user_email}", "marker.ready", marker_event_data(marker))
+            return marker
+        await StatsCRUD.on_marker_changed(old, marker)
+        event_bus.publish(f"markers:{user_email}", "marker.updated", marker_event_data(marker))
+        return marker
+    
     @staticmethod
     async def update_marker_image(
         marker_id: PydanticObjectId,
@@ -65,10 +240,160 @@ class MarkerCRUD:
         Actualiza la imagen de un marcador
         Retorna el marcador actualizado o None si no existe/no pertenece al usuario
         """
-        marker = await Marker.get(marker_id)
-        if not marker or marker.user_email != user_email:
+        return await MarkerCRUD.update_marker(marker_id, user_email, {"image_url": image_url})
+    
+    @staticmethod
+    async def get_owned_marker_status(marker_id: PydanticObjectId, user_email: EmailStr) -> Optional[str]:
+        """
+        Estado del marcador ("pending", "ready" o "failed") si pertenece al usuario, None si no
+        Lectura proyectada y barata para validar antes de llamar a servicios externos
+        """
+        doc = await Marker.get_motor_collection().find_one(
+            _owner_filter(marker_id, user_email), {"status": 1}
+        )
+        if doc is None:
             return None
+        return doc.get("status", "ready")
+    
+    @staticmethod
+    async def get_owned_marker_states(
+        marker_ids: List[PydanticObjectId],
+        user_email: EmailStr
+    ) -> Dict[PydanticObjectId, Tuple[str, int]]:
+        """
+        Estado y versión de los marcadores indicados que pertenecen al usuario (los demás no aparecen)
+        Versión en lote de get_owned_marker_status
+        """
+        return {
+            doc["_id"]: (doc.get("status", "ready"), doc.get("version", 0))
+            for doc in await Marker.get_motor_collection().find(
+                {"_id": {"$in": marker_ids}, "user_email": user_email}, {"status": 1, "version": 1}
+            ).to_list(length=None)
+        }
+    
+    @staticmethod
+    async def bulk_delete_markers(
+        user_email: EmailStr,
+        marker_ids: Optional[List[PydanticObjectId]] = None,
+        filters: Optional[Dict[str, Any]] = None,
+        max_items: Optional[int] = None
+    ) -> Optional[List[PydanticObjectId]]:
+        """
+        Elimina en lote marcadores del usuario por IDs o por criterios
+        filters admite location_name (contiene, sin distinguir mayúsculas), created_before y created_after
+        Retorna los IDs eliminados, o None si el filtro coincide con más de max_items marcadores
+        Lanza ValueError si no se indican IDs ni ningún criterio
+        """
+        query: Dict[str, Any] = {"user_email": user_email}
+        if marker_ids is not None:
+            query["_id"] = {"$in": marker_ids}
+        if filters:
+            if filters.get("location_name"):
+                query["location_name"] = {"$regex": re.escape(filters["location_name"]), "$options": "i"}
+            created: Dict[str, Any] = {}
+            if filters.get("created_before"):
+                created["$lt"] = filters["created_before"]
+            if filters.get("created_after"):
+                created["$gt"] = filters["created_after"]
+            if created:
+                query["created_at"] = created
+        if len(query) == 1:
+            # Nunca se borra filtrando solo por propietario
+            raise ValueError("Indica marker_ids o al menos un criterio de filtro")
         
-        marker.image_url = image_url
-        await marker.save()
-        return marker
+        collection = Marker.get_motor_collection()
+        # Se leen antes los IDs afectados para poder informar del resultado de cada uno
+        cursor = collection.find(query, {"_id": 1})
+        if max_items is not None:
+            cursor = cursor.limit(max_items + 1)
+        found_ids = [doc["_id"] for doc in await cursor.to_list(length=None)]
+        if max_items is not None and len(found_ids) > max_items:
+            return None
+        if not found_ids:
+            return []
+        
+        await collection.delete_many({"_id": {"$in": found_ids}, "user_email": user_email})
+        # Cancela los trabajos de los que aún estuvieran pendientes (consulta por el índice de marker_id)
+        await MarkerJobCRUD.delete_jobs_for_markers(found_ids)
+        
+        await StatsCRUD.invalidate(user_email)
+        marker_tile_cache.invalidate_user(user_email)
+        for marker_id in found_ids:
+            event_bus.publish(f"markers:{user_email}", "marker.deleted", {"id": str(marker_id)})
+        return found_ids
+    
+    @staticmethod
+    async def bulk_update_markers(
+        user_email: EmailStr,
+        updates: List[Tuple[PydanticObjectId, Dict[str, Any], Optional[int]]]
+    ) -> Dict[PydanticObjectId, Tuple[str, Optional[int]]]:
+        """
+        Actualiza en lote marcadores del usuario con un único bulk_write
+        updates: lista de (id, campos a $set, versión esperada o None)
+        Retorna por ID el resultado ("updated", "not_found", "conflict" o "pending") y la versión resultante
+        """
+        collection = Marker.get_motor_collection()
+        ids = [marker_id for marker_id, _, _ in updates]
+        current = {
+            doc["_id"]: (doc.get("version", 0), doc.get("status", "ready"))
+            for doc in await collection.find(
+                {"_id": {"$in": ids}, "user_email": user_email}, {"version": 1, "status": 1}
+            ).to_list(length=None)
+        }
+        
+        results: Dict[PydanticObjectId, Tuple[str, Optional[int]]] = {}
+        operations = []
+        # Marca de este lote: permite saber después qué escrituras se aplicaron realmente
+        # (el campo no forma parte del modelo, así que nunca se serializa)
+        write_token = ObjectId()
+        for marker_id, fields, expected_version in updates:
+            if marker_id not in current:
+                results[marker_id] = ("not_found", None)
+                continue
+            version, marker_status = current[marker_id]
+            if marker_status == "pending":
+                results[marker_id] = ("pending", version)
+                continue
+            if expected_version is not None and expected_version != version:
+                results[marker_id] = ("conflict", version)
+                continue
+            if "latitude" in fields:
+                # Con coordenadas nuevas un marcador fallido pasa a ready
+                fields = {**fields, "status": "ready", "processing_error": None}
+            # El filtro por versión leída evita pisar cambios concurrentes entre lectura y escritura
+            update: Dict[str, Any] = {
+                "$inc": {"version": 1},
+                "$set": {**fields, "bulk_write_token": write_token}
+            }
+            query = _owner_filter(marker_id, user_email, version)
+            query["status"] = {"$ne": "pending"}
+            operations.append(UpdateOne(query, update))
+            results[marker_id] = ("updated", version + 1)
+        
+        if operations:
+            result = await collection.bulk_write(operations, ordered=False)
+            if result.matched_count < len(operations):
+                # Alguno cambió entre medias: solo se aplicaron los que llevan la marca de este lote
+                # (la versión no basta: otra escritura concurrente también la incrementa)
+                pending = [i for i, (status, _) in results.items() if status == "updated"]
+                after = {
+                    doc["_id"]: doc
+                    for doc in await collection.find(
+                        {"_id": {"$in": pending}}, {"version": 1, "bulk_write_token": 1}
+                    ).to_list(length=None)
+                }
+                for marker_id in pending:
+                    doc = after.get(marker_id)
+                    if doc is None or doc.get("bulk_write_token") != write_token:
+                        results[marker_id] = ("conflict", doc.get("version", 0) if doc else None)
+            
+            if any("location_name" in fields for _, fields, _ in updates):
+                await StatsCRUD.invalidate(user_email)
+            marker_tile_cache.invalidate_user(user_email)
+            # Sin el documento completo: los clientes recargan los marcadores indicados
+            updated = [str(i) for i, (status, _) in results.items() if status == "updated"]
+            if updated:
+                event_bus.publish(f"markers:{user_email}", "markers.changed", {"ids": updated})
+        
+        return results
+
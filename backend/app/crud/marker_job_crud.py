@@ -0,0 +1,104 @@
+from app.models.marker_job import MarkerJob
+from pydantic import EmailStr
+from typing import Any, Dict, List, Optional
+from datetime import datetime, timedelta
+from beanie import PydanticObjectId, UpdateResponse
+from beanie.operators import Inc, Set
+
+
+def _claimable_filter(now: datetime) -> Dict[str, Any]:
+    """Trabajos en cola listos para ejecutarse o cuyo worker perdió el lease"""
+    return {
+        "$or": [
+            {"status": "queued", "next_attempt_at": {"$lte": now}},
+            {"status": "running", "locked_until": {"$lt": now}},
+        ]
+    }
+
+
+class MarkerJobCRUD:
+    """
+    CRUD operations para MarkerJob
+    """
+    
+    @staticmethod
+    async def create_job(
+        marker_id: PydanticObjectId,
+        user_email: EmailStr,
+        location_name: str,
+        latitude: Optional[float] = None,
+        longitude: Optional[float] = None,
+        image_data: Optional[str] = None,
+        image_url: Optional[str] = None
+    ) -> MarkerJob:
+        """Encola un nuevo trabajo de creación de marcador"""
+        job = MarkerJob(
+            marker_id=marker_id,
+            user_email=user_email,
+            location_name=location_name,
+            latitude=latitude,
+            longitude=longitude,
+            image_data=image_data,
+            image_url=image_url
+        )
+        await job.insert()
+        return job
+    
+    @staticmethod
+    async def claim_job(job_id: PydanticObjectId, lease_seconds: float) -> Optional[MarkerJob]:
+        """
+        Reclama un trabajo de forma atómica para este worker
+        Retorna None si otro worker ya lo tiene o todavía no toca ejecutarlo
+        """
+        now = datetime.utcnow()
+        return await MarkerJob.find_one({"_id": job_id, **_claimable_filter(now)}).update(
+            Set({"status": "running", "locked_until": now + timedelta(seconds=lease_seconds)}),
+            Inc({MarkerJob.attempts: 1}),
+            response_type=UpdateResponse.NEW_DOCUMENT
+        )
+    
+    @staticmethod
+    async def get_claimable_job_ids(limit: int = 100) -> List[PydanticObjectId]:
+        """Obtiene los IDs de los trabajos que pueden (re)ejecutarse ahora"""
+        jobs = await MarkerJob.find(_claimable_filter(datetime.utcnow())).limit(limit).to_list()
+        return [job.id for job in jobs]
+    
+    @staticmethod
+    async def save_progress(job_id: PydanticObjectId, fields: Dict[str, Any]) -> None:
+        """Guarda el progreso parcial para no repetir pasos ya completados al reintentar"""
+        await MarkerJob.find_one({"_id": job_id}).update(Set(fields))
+    
+    @staticmethod
+    async def schedule_retry(job_id: PydanticObjectId, delay_seconds: float, error: str) -> None:
+        """Devuelve el trabajo a la cola para reintentarlo pasado el retraso indicado"""
+        await MarkerJob.find_one({"_id": job_id}).update(Set({
+            "status": "queued",
+            "locked_until": None,
+            "last_error": error,
+            "next_attempt_at": datetime.utcnow() + timedelta(seconds=delay_seconds)
+        }))
+    
+    @staticmethod
+    async def mark_failed(job_id: PydanticObjectId, error: str) -> None:
+        """Marca el trabajo como fallido definitivamente"""
+        await MarkerJob.find_one({"_id": job_id}).update(Set({
+            "status": "failed",
+            "locked_until": None,
+            "last_error": error,
+            "image_data": None
+        }))
+    
+    @staticmethod
+    async def delete_job(job_id: PydanticObjectId) -> None:
+        """Elimina un trabajo completado"""
+        await MarkerJob.find_one({"_id": job_id}).delete()
+    
+    @staticmethod
+    async def delete_jobs_for_markers(marker_ids: List[PydanticObjectId]) -> None:
+        """Elimina (cancela) los trabajos de marcadores eliminados o corregidos a mano"""
+        await MarkerJob.get_motor_collection().delete_many({"marker_id": {"$in": marker_ids}})
+    
+    @staticmethod
+    async def job_exists(job_id: PydanticObjectId) -> bool:
+        """Indica si el trabajo sigue existiendo (no se canceló al eliminar su marcador)"""
+        return await MarkerJob.get_motor_collection().find_one({"_id": job_id}, {"_id": 1}) is not None
@@ -0,0 +1,169 @@
+from app.models.marker import Marker, UNREADY_STATUSES
+from app.models.user_stats import UserStats
+from app.core.geo import path_length_km
+from pydantic import EmailStr
+from typing import Any, Dict, List, Optional
+from collections import Counter
+from datetime import datetime
+from pymongo.errors import DuplicateKeyError
+
+
+def country_from_location(location_name: str) -> str:
+    """
+    Obtiene el país a partir del nombre de la ubicación ("Paris, France" -> "France")
+    Se toma el último componente separado por comas; "." y "$" no son válidos en claves de MongoDB
+    """
+    country = location_name.rsplit(",", 1)[-1].strip() or location_name.strip()
+    return country.replace(".", "").replace("$", "")
+
+
+def _is_ready(marker: Marker) -> bool:
+    return (
+        marker.status not in UNREADY_STATUSES
+        and marker.latitude is not None
+        and marker.longitude is not None
+    )
+
+
+def _stats_collection():
+    return UserStats.get_motor_collection()
+
+
+def _route_fields(docs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Campos que dependen del orden de los marcadores (docs ordenados por created_at)"""
+    return {
+        "first_trip": docs[0]["created_at"] if docs else None,
+        "last_trip": docs[-1]["created_at"] if docs else None,
+        "total_distance_km": path_length_km(
+            [d["latitude"] for d in docs],
+            [d["longitude"] for d in docs]
+        )
+    }
+
+
+async def _ready_marker_docs(user_email: EmailStr, projection: Dict[str, int]) -> List[Dict[str, Any]]:
+    cursor = Marker.get_motor_collection().find(
+        {"user_email": user_email, "status": {"$nin": UNREADY_STATUSES}}, projection
+    ).sort("created_at", 1)
+    return await cursor.to_list(length=None)
+
+
+async def _apply_change(user_email: EmailStr, increments: Dict[str, int], emptied_country: Optional[str] = None) -> None:
+    """
+    Aplica los contadores conmutativos ($inc) e incrementa revision en una sola escritura
+    Con upsert: si el documento no existía queda sin rebuilt_at y se recalcula entero al leerlo
+    """
+    await _stats_collection().update_one(
+        {"user_email": user_email},
+        {"$inc": {**increments, "revision": 1}},
+        upsert=True
+    )
+    if emptied_country is not None:
+        # Se quita el país si se quedó sin marcadores (el filtro hace la comprobación atómica)
+        key = f"countries.{emptied_country}"
+        await _stats_collection().update_one(
+            {"user_email": user_email, key: {"$lte": 0}}, {"$unset": {key: ""}}
+        )
+
+
+class StatsCRUD:
+    """
+    Operaciones sobre las estadísticas materializadas de viaje (UserStats)
+    - places_count y countries se mantienen con $inc atómicos (conmutativos, seguros con concurrencia)
+    - Distancia y primer/último viaje dependen del orden de los marcadores: cada cambio incrementa
+      revision y get_stats los recalcula solo si route_revision se quedó atrás
+    - Los recálculos escriben condicionados a la revision leída antes de recorrer los marcadores;
+      si otro cambio llega entre medias la escritura no se aplica y se repite en la siguiente lectura
+    """
+    
+    @staticmethod
+    async def get_stats(user_email: EmailStr) -> UserStats:
+        """
+        Obtiene las estadísticas del usuario
+        Sin cambios desde el último cálculo es una única lectura por el índice de user_email
+        """
+        stats = await UserStats.find_one(UserStats.user_email == user_email)
+        if stats is None or stats.rebuilt_at is None:
+            return await StatsCRUD.rebuild_stats(user_email)
+        if stats.route_revision != stats.revision:
+            docs = await _ready_marker_docs(user_email, {"latitude": 1, "longitude": 1, "created_at": 1})
+            fields = {**_route_fields(docs), "route_revision": stats.revision}
+            await _stats_collection().update_one(
+                {"user_email": user_email, "revision": stats.revision}, {"$set": fields}
+            )
+            stats = stats.model_copy(update=fields)
+        return stats
+    
+    @staticmethod
+    async def rebuild_stats(user_email: EmailStr) -> UserStats:
+        """
+        Recalcula desde cero las estadísticas del usuario
+        Solo proyecta los campos necesarios y calcula la distancia con haversine vectorizado
+        """
+        current = await _stats_collection().find_one({"user_email": user_email}, {"revision": 1})
+        revision = current.get("revision", 0) if current else 0
+        
+        docs = await _ready_marker_docs(
+            user_email, {"location_name": 1, "latitude": 1, "longitude": 1, "created_at": 1}
+        )
+        fields: Dict[str, Any] = {
+            "places_count": len(docs),
+            "countries": dict(Counter(country_from_location(d["location_name"]) for d in docs)),
+            **_route_fields(docs),
+            "rebuilt_at": datetime.utcnow(),
+            "route_revision": revision
+        }
+        try:
+            # Si revision cambió entre medias, el upsert choca con el índice único y no se escribe
+            await _stats_collection().update_one(
+                {"user_email": user_email, "revision": revision},
+                {"$set": fields},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            pass
+        return UserStats(user_email=user_email, revision=revision, **fields)
+    
+    @staticmethod
+    async def invalidate(user_email: EmailStr) -> None:
+        """Fuerza un recálculo completo en la siguiente lectura (operaciones en lote)"""
+        await _stats_collection().update_one(
+            {"user_email": user_email},
+            {"$inc": {"revision": 1}, "$set": {"rebuilt_at": None}},
+            upsert=True
+        )
+    
+    @staticmethod
+    async def on_marker_added(marker: Marker) -> None:
+        """Suma un marcador listo"""
+        if not _is_ready(marker):
+            return
+        country = country_from_location(marker.location_name)
+        await _apply_change(marker.user_email, {"places_count": 1, f"countries.{country}": 1})
+    
+    @staticmethod
+    async def on_marker_removed(marker: Marker) -> None:
+        """Resta un marcador listo ya eliminado"""
+        if not _is_ready(marker):
+            return
+        country = country_from_location(marker.location_name)
+        await _apply_change(
+            marker.user_email, {"places_count": -1, f"countries.{country}": -1}, emptied_country=country
+        )
+    
+    @staticmethod
+    async def on_marker_changed(old: Marker, new: Marker) -> None:
+        """Aplica el cambio de ubicación de un marcador (coordenadas y/o país)"""
+        if not _is_ready(old) or not _is_ready(new):
+            return
+        old_country = country_from_location(old.location_name)
+        new_country = country_from_location(new.location_name)
+        moved = (old.latitude, old.longitude) != (new.latitude, new.longitude)
+        if old_country != new_country:
+            await _apply_change(
+                old.user_email,
+                {f"countries.{old_country}": -1, f"countries.{new_country}": 1},
+                emptied_country=old_country
+            )
+        elif moved:
+            await _apply_change(old.user_email, {})
@@ -0,0 +1,125 @@
+from app.models.user import SEARCH_KEYS_VERSION, User
+from app.models.user_search_key import UserSearchKey
+from app.core.utils import normalize_text
+from typing import Dict, List, Optional, Tuple
+from beanie import PydanticObjectId
+from pymongo import UpdateOne
+import base64
+import json
+
+# Posición en el índice (key, user_id) donde continúa la siguiente página
+SearchCursor = Tuple[str, PydanticObjectId]
+
+
+def encode_search_cursor(cursor: SearchCursor) -> str:
+    """Cursor opaco para el cliente"""
+    key, user_id = cursor
+    raw = json.dumps([key, str(user_id)]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_search_cursor(value: str) -> SearchCursor:
+    """Inversa de encode_search_cursor; lanza ValueError si el cursor no es válido"""
+    try:
+        key, user_id = json.loads(base64.urlsafe_b64decode(value.encode("ascii")))
+        return str(key), PydanticObjectId(user_id)
+    except Exception:
+        raise ValueError("Cursor inválido")
+
+
+class UserCRUD:
+    """
+    CRUD operations para User
+    """
+    
+    @staticmethod
+    async def search_users(
+        query: str,
+        limit: int = 10,
+        cursor: Optional[SearchCursor] = None
+    ) -> Tuple[List[User], Optional[SearchCursor]]:
+        """
+        Busca usuarios cuyo nombre (o alguna palabra del nombre) empiece por query
+        Recorre user_search_keys en el orden de su índice (key, user_id) a partir del cursor,
+        así que cada página cuesta O(log n + limit) aunque el prefijo coincida con muchos usuarios
+        Un usuario con varias claves coincidentes solo se devuelve en la menor de ellas
+        Retorna los usuarios y el cursor para la siguiente página (None si no hay más)
+        """
+        prefix = normalize_text(query)
+        if not prefix:
+            return [], None
+        
+        collection = UserSearchKey.get_motor_collection()
+        key_range = {"$gte": prefix, "$lt": prefix + "\uffff"}
+        position = cursor
+        found: List[Tuple[SearchCursor, User]] = []
+        
+        while len(found) <= limit:
+            filters: Dict = {"key": key_range}
+            if position is not None:
+                last_key, last_user_id = position
+                filters["$or"] = [
+                    {"key": {"$gt": last_key}},
+                    {"key": last_key, "user_id": {"$gt": last_user_id}}
+                ]
+            # Se pide algo más de lo necesario por si hay claves repetidas de un mismo usuario
+            batch_size = 2 * (limit + 1 - len(found))
+            entries = await collection.find(filters, {"key": 1, "user_id": 1}).sort(
+                [("key", 1), ("user_id", 1)]
+            ).limit(batch_size).to_list(length=None)
+            if not entries:
+                break
+            
+            users = {
+                user.id: user
+                for user in await User.find({"_id": {"$in": [e["user_id"] for e in entries]}}).to_list()
+            }
+            for entry in entries:
+                position = (entry["key"], entry["user_id"])
+                user = users.get(entry["user_id"])
+                if user is None:
+                    continue
+                matching = [key for key in user.search_keys if key.startswith(prefix)]
+                if matching and min(matching) == entry["key"]:
+                    found.append((position, user))
+                    if len(found) > limit:
+                        break
+            if len(entries) < batch_size:
+                break
+        
+        # Se busca uno más de limit para saber si hay página siguiente
+        next_cursor = found[limit - 1][0] if len(found) > limit else None
+        return [user for _, user in found[:limit]], next_cursor
+    
+    @staticmethod
+    async def get_user_by_email(email: str) -> Optional[User]:
+        """
+        Busca un usuario por su email completo (por el índice único de email)
+        Se compara tal cual se guardó al registrarse, sin normalizar mayúsculas
+        """
+        return await User.find_one(User.email == email.strip())
+    
+    @staticmethod
+    async def sync_search_keys(user: User) -> None:
+        """Sincroniza las entradas de user_search_keys con las claves del usuario"""
+        collection = UserSearchKey.get_motor_collection()
+        await collection.delete_many({"user_id": user.id, "key": {"$nin": user.search_keys}})
+        if user.search_keys:
+            await collection.bulk_write([
+                UpdateOne({"key": key, "user_id": user.id}, {"$setOnInsert": {"key": key, "user_id": user.id}}, upsert=True)
+                for key in user.search_keys
+            ], ordered=False)
+        await User.get_motor_collection().update_one(
+            {"_id": user.id},
+            {"$set": {"search_keys": user.search_keys, "search_keys_version": SEARCH_KEYS_VERSION}}
+        )
+        user.search_keys_version = SEARCH_KEYS_VERSION
+    
+    @staticmethod
+    async def backfill_search_keys() -> int:
+        """Genera las claves de búsqueda de usuarios creados con una versión anterior de las claves"""
+        users = await User.find({"search_keys_version": {"$ne": SEARCH_KEYS_VERSION}}).to_list()
+        for user in users:
+            user.refresh_search_keys()
+            await UserCRUD.sync_search_keys(user)
+        return len(users)
@@ -1,4 +1,6 @@
 from app.models.visit import Visit
+from app.database.database import collection_for
+from app.core.events import event_bus, visit_event_data
 from pydantic import EmailStr
 from typing import List
 
@@ -21,15 +23,21 @@ class VisitCRUD:
             visitor_oauth_id=visitor_oauth_id
         )
         await visit.insert()
+        event_bus.publish(f"visits:{visited_user_email}", "visit.created", visit_event_data(visit))
         return visit
     
     @staticmethod
-    async def get_user_visits(user_email: EmailStr, limit: int = 50) -> List[Visit]:
+    async def get_user_visits(
+        user_email: EmailStr,
+        limit: int = 50,
+        query_class: str = "analytics"
+    ) -> List[Visit]:
         """
         Obtiene las visitas recibidas por un usuario
         Ordenadas de más reciente a más antigua
+        Por defecto se leen de un secundario si la read preference "analytics" lo permite
         """
-        visits = await Visit.find(
-            Visit.visited_user_email == user_email
-        ).sort(-Visit.visited_at).limit(limit).to_list()
-        return visits
+        docs = await collection_for(Visit, query_class).find(
+            {"visited_user_email": user_email}
+        ).sort("visited_at", -1).limit(limit).to_list(length=None)
+        return [Visit.model_validate(doc) for doc in docs]
@@ -1,10 +1,15 @@
 import logging
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.read_preferences import Nearest, Primary, PrimaryPreferred, Secondary, SecondaryPreferred
 from beanie import init_beanie
 from app.core.config import settings
 from app.models.user import User
 from app.models.marker import Marker
 from app.models.visit import Visit
+from app.models.marker_job import MarkerJob
+from app.models.user_stats import UserStats
+from app.models.heatmap_grid import HeatmapGrid
+from app.models.user_search_key import UserSearchKey
 
 # Cliente global para reutilización en serverless
 _client = None
@@ -19,13 +24,56 @@ async def init_db():
         
         await init_beanie(
             database=_client[settings.MONGODB_DATABASE_NAME],
-            document_models=[User, Marker, Visit]
+            document_models=[User, Marker, Visit, MarkerJob, UserStats, HeatmapGrid, UserSearchKey]
         )
         
         logging.info("Conexión a MongoDB y Beanie inicializados exitosamente.")
     
     return _client
 
+def get_database():
+    """Retorna la base de datos de la aplicación (requiere init_db previo)"""
+    if _client is None:
+        raise RuntimeError("La base de datos no está inicializada; llama a init_db() primero")
+    return _client[settings.MONGODB_DATABASE_NAME]
+
+_READ_MODES = {
+    "primary": Primary,
+    "primaryPreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest,
+}
+
+
+def read_preference_for(query_class: str):
+    """
+    Read preference para una clase de consulta
+    - "primary": escrituras y lecturas del propio usuario (read-your-own-writes)
+    - "public": mapas públicos de otros usuarios, toleran cierto retraso
+    - "analytics": consultas agregadas/históricas (visitas, estadísticas)
+    """
+    if query_class == "public":
+        mode, max_staleness = settings.MONGODB_READ_PREFERENCE_PUBLIC, settings.MONGODB_MAX_STALENESS_PUBLIC_SECONDS
+    elif query_class == "analytics":
+        mode, max_staleness = settings.MONGODB_READ_PREFERENCE_ANALYTICS, settings.MONGODB_MAX_STALENESS_ANALYTICS_SECONDS
+    else:
+        return Primary()
+    
+    if mode not in _READ_MODES:
+        raise ValueError(f"Read preference desconocida: {mode}")
+    if mode == "primary":
+        return Primary()
+    return _READ_MODES[mode](max_staleness=max_staleness)
+
+
+def collection_for(document_model, query_class: str = "primary"):
+    """Colección Motor de un modelo Beanie con la read preference de la clase de consulta"""
+    return document_model.get_motor_collection().with_options(
+        read_preference=read_preference_for(query_class)
+    )
+
+
 async def connect_to_mongo():
     """Mantener compatibilidad con código existente"""
     return await init_db()
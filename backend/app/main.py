@@ -3,8 +3,14 @@ from fastapi.middleware.cors import CORSMiddleware
 from starlette.middleware.sessions import SessionMiddleware
 import logging
 from app.database.database import init_db
-from app.routers import auth, markers, visits
+from app.routers import admin, auth, heatmap, markers, places, users, visits
 from app.core.config import settings
+from app.core.admission import AdmissionControlMiddleware
+from app.core.marker_jobs import marker_job_worker
+from app.core.heatmap import heatmap_service
+from app.core.events import event_bus
+from app.core.profiling import ProfilingMiddleware
+from app.crud.user_crud import UserCRUD
 
 # Configurar logging
 logging.basicConfig(
@@ -22,6 +28,30 @@ app = FastAPI(
 @app.on_event("startup")
 async def startup_event():
     await init_db()
+    
+    # Usuarios anteriores a la búsqueda por prefijo (normalmente ninguno)
+    backfilled = await UserCRUD.backfill_search_keys()
+    if backfilled:
+        logging.info(f"Claves de búsqueda generadas para {backfilled} usuarios")
+    
+    await marker_job_worker.start()
+    await heatmap_service.start()
+    await event_bus.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await marker_job_worker.stop()
+    await heatmap_service.stop()
+    await event_bus.stop()
+
+# Perfilado bajo demanda (el más interno: mide el endpoint, no la espera en admisión)
+if settings.PROFILING_ENABLED:
+    app.add_middleware(ProfilingMiddleware)
+
+# Control de admisión para endpoints costosos (queda por dentro de CORS para que los 429 lleven sus cabeceras)
+if settings.RATE_LIMIT_ENABLED:
+    app.add_middleware(AdmissionControlMiddleware)
 
 # Configurar SessionMiddleware (requerido para OAuth)
 app.add_middleware(
@@ -42,6 +72,10 @@ app.add_middleware(
 app.include_router(auth.router)
 app.include_router(markers.router)
 app.include_router(visits.router)
+app.include_router(users.router)
+app.include_router(heatmap.router)
+app.include_router(places.router)
+app.include_router(admin.router)
 
 @app.get("/")
 def read_root():
@@ -0,0 +1,30 @@
+from beanie import Document, PydanticObjectId
+from pydantic import Field, ConfigDict
+from typing import Optional
+from datetime import datetime
+from pymongo import ASCENDING, IndexModel
+
+
+class HeatmapGrid(Document):
+    """
+    Rejilla precalculada de densidad global de marcadores para un nivel de resolución
+    Los conteos se guardan como array uint32 comprimido con zlib (fila 0 = latitud -90)
+    """
+    id: Optional[PydanticObjectId] = Field(default=None, alias="_id")
+    level: int  # 0 = más gruesa (índice único)
+    width: int  # Celdas en longitud
+    height: int  # Celdas en latitud
+    counts: bytes  # Conteos uint32 little-endian comprimidos con zlib
+    total: int  # Número de marcadores agregados
+    built_at: datetime = Field(default_factory=datetime.utcnow)
+    
+    model_config = ConfigDict(
+        populate_by_name=True,
+        json_encoders={PydanticObjectId: str}
+    )
+    
+    class Settings:
+        name = "heatmap_grids"
+        indexes = [
+            IndexModel([("level", ASCENDING)], unique=True),
+        ]
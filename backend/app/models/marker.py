@@ -2,6 +2,10 @@ from beanie import Document, PydanticObjectId
 from pydantic import EmailStr, Field, ConfigDict
 from typing import Optional, Annotated
 from datetime import datetime
+from pymongo import ASCENDING, IndexModel
+
+# Estados de marcadores que aún no tienen coordenadas (creación asíncrona)
+UNREADY_STATUSES = ["pending", "failed"]
 
 
 class Marker(Document):
@@ -12,11 +16,14 @@ class Marker(Document):
     id: Optional[PydanticObjectId] = Field(default=None, alias="_id")
     user_email: EmailStr = Field(..., index=True)  # Email del usuario propietario
     location_name: str  # Nombre del país o ciudad
-    latitude: float  # Coordenada latitud
-    longitude: float  # Coordenada longitud
+    latitude: Optional[float] = None  # Coordenada latitud (None mientras está pendiente)
+    longitude: Optional[float] = None  # Coordenada longitud (None mientras está pendiente)
     image_url: Optional[str] = None  # URL de la imagen (Cloudinary o almacenada)
     description: Optional[str] = None  # Descripción opcional del lugar
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    version: int = 0  # Versión para control de concurrencia optimista
+    status: str = "ready"  # "pending" (creación asíncrona en curso), "ready" o "failed"
+    processing_error: Optional[str] = None  # Motivo del fallo si status == "failed"
     
     model_config = ConfigDict(
         populate_by_name=True,
@@ -35,3 +42,7 @@ class Marker(Document):
     
     class Settings:
         name = "markers"
+        indexes = [
+            IndexModel([("user_email", ASCENDING), ("created_at", ASCENDING)]),
+            IndexModel([("user_email", ASCENDING), ("latitude", ASCENDING), ("longitude", ASCENDING)]),
+        ]
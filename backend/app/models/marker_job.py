@@ -0,0 +1,40 @@
+from beanie import Document, PydanticObjectId
+from pydantic import EmailStr, Field, ConfigDict
+from typing import Optional
+from datetime import datetime
+from pymongo import ASCENDING, IndexModel
+
+
+class MarkerJob(Document):
+    """
+    Trabajo pendiente de la creación asíncrona de un marcador
+    Persiste en MongoDB para que los trabajos sobrevivan a reinicios del proceso
+    """
+    id: Optional[PydanticObjectId] = Field(default=None, alias="_id")
+    marker_id: PydanticObjectId  # Marcador pendiente asociado
+    user_email: EmailStr  # Email del propietario del marcador
+    location_name: str  # Ubicación a geocodificar
+    latitude: Optional[float] = None  # Se rellena en cuanto el geocoding tiene éxito
+    longitude: Optional[float] = None
+    image_data: Optional[str] = None  # Imagen base64 pendiente de subir a Cloudinary
+    image_url: Optional[str] = None  # URL final de la imagen (ya subida o recibida como URL)
+    status: str = "queued"  # "queued", "running" o "failed"
+    attempts: int = 0  # Intentos realizados
+    last_error: Optional[str] = None
+    next_attempt_at: datetime = Field(default_factory=datetime.utcnow)  # Reintento no antes de
+    locked_until: Optional[datetime] = None  # Fin del lease del worker que lo procesa
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    
+    model_config = ConfigDict(
+        populate_by_name=True,
+        json_encoders={PydanticObjectId: str}
+    )
+    
+    class Settings:
+        name = "marker_jobs"
+        indexes = [
+            # Las dos ramas del barrido de trabajos reclamables
+            IndexModel([("status", ASCENDING), ("next_attempt_at", ASCENDING)]),
+            IndexModel([("status", ASCENDING), ("locked_until", ASCENDING)]),
+            IndexModel([("marker_id", ASCENDING)]),
+        ]
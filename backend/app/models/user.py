@@ -1,7 +1,23 @@
-from beanie import Document, PydanticObjectId
+from beanie import Document, PydanticObjectId, Insert, Replace, Save, before_event
 from pydantic import EmailStr, Field, ConfigDict
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime
+from pymongo import ASCENDING, IndexModel
+from app.core.utils import normalize_text
+
+
+# Se incrementa al cambiar build_search_keys para regenerar las claves al arrancar
+SEARCH_KEYS_VERSION = 2
+
+
+def build_search_keys(name: str) -> List[str]:
+    """
+    Claves normalizadas para la búsqueda por prefijo de usuarios: nombre completo y cada palabra
+    El email no se indexa: solo se busca por email completo (no se pueden enumerar por prefijo)
+    """
+    normalized_name = normalize_text(name or "")
+    keys = [normalized_name, *normalized_name.split()]
+    return sorted({key for key in keys if key})
 
 
 class User(Document):
@@ -10,13 +26,15 @@ class User(Document):
     Almacena la información del usuario autenticado vía Google/Facebook
     """
     id: Optional[PydanticObjectId] = Field(default=None, alias="_id")
-    email: EmailStr = Field(..., unique=True, index=True)
+    email: EmailStr  # Índice único (Settings.indexes)
     name: str
     picture: Optional[str] = None  # URL de la foto de perfil del proveedor OAuth
     oauth_provider: str  # "google", "facebook", etc.
     oauth_id: str  # ID único del proveedor OAuth
     created_at: datetime = Field(default_factory=datetime.utcnow)
     last_login: datetime = Field(default_factory=datetime.utcnow)
+    search_keys: List[str] = Field(default_factory=list)  # Claves normalizadas para búsqueda por prefijo
+    search_keys_version: int = 0  # SEARCH_KEYS_VERSION con el que se generaron las claves en user_search_keys
     
     model_config = ConfigDict(
         populate_by_name=True,
@@ -32,5 +50,14 @@ class User(Document):
         }
     )
     
+    @before_event(Insert, Replace, Save)
+    def refresh_search_keys(self):
+        """Mantiene las claves de búsqueda sincronizadas con el nombre"""
+        self.search_keys = build_search_keys(self.name)
+    
     class Settings:
         name = "users"
+        indexes = [
+            IndexModel([("email", ASCENDING)], unique=True),
+            IndexModel([("search_keys_version", ASCENDING)]),
+        ]
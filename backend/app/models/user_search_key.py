@@ -0,0 +1,19 @@
+from beanie import Document, PydanticObjectId
+from pymongo import ASCENDING, IndexModel
+
+
+class UserSearchKey(Document):
+    """
+    Clave de búsqueda de un usuario (una entrada por clave)
+    Ordenadas por (key, user_id), una búsqueda por prefijo se pagina recorriendo el índice
+    en orden, sin ordenar en memoria los resultados
+    """
+    key: str  # Nombre completo o palabra del nombre normalizada
+    user_id: PydanticObjectId
+    
+    class Settings:
+        name = "user_search_keys"
+        indexes = [
+            IndexModel([("key", ASCENDING), ("user_id", ASCENDING)], unique=True),
+            IndexModel([("user_id", ASCENDING)]),
+        ]
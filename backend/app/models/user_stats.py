@@ -0,0 +1,44 @@
+from beanie import Document, PydanticObjectId
+from pydantic import EmailStr, Field, ConfigDict
+from typing import Dict, Optional
+from datetime import datetime
+from pymongo import ASCENDING, IndexModel
+
+
+class UserStats(Document):
+    """
+    Estadísticas de viaje materializadas por usuario
+    places_count y countries se mantienen de forma incremental; distancia y primer/último viaje
+    se recalculan al leerlas si route_revision no coincide con revision
+    """
+    id: Optional[PydanticObjectId] = Field(default=None, alias="_id")
+    user_email: EmailStr  # Email del usuario propietario (índice único)
+    places_count: int = 0  # Número de marcadores (lugares visitados)
+    countries: Dict[str, int] = Field(default_factory=dict)  # Marcadores por país
+    first_trip: Optional[datetime] = None  # Fecha del primer marcador
+    last_trip: Optional[datetime] = None  # Fecha del último marcador
+    total_distance_km: float = 0.0  # Distancia ortodrómica entre marcadores consecutivos
+    rebuilt_at: Optional[datetime] = None  # Último recálculo completo (None: contadores no válidos)
+    revision: int = 0  # Se incrementa con cada cambio de marcadores que afecta a las estadísticas
+    route_revision: int = -1  # revision con la que se calcularon distancia y primer/último viaje
+    
+    model_config = ConfigDict(
+        populate_by_name=True,
+        json_encoders={PydanticObjectId: str},
+        json_schema_extra={
+            "example": {
+                "user_email": "user@example.com",
+                "places_count": 3,
+                "countries": {"France": 2, "Spain": 1},
+                "first_trip": "2025-01-10T12:00:00Z",
+                "last_trip": "2025-06-02T09:30:00Z",
+                "total_distance_km": 1534.2
+            }
+        }
+    )
+    
+    class Settings:
+        name = "user_stats"
+        indexes = [
+            IndexModel([("user_email", ASCENDING)], unique=True),
+        ]
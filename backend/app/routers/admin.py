@@ -0,0 +1,45 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import JSONResponse
+from app.models.user import User
+from app.core.auth import get_current_admin
+from app.core.profiling import profile_store
+from app.core.geocoding import geocoder
+
+router = APIRouter(prefix="/admin", tags=["Admin"])
+
+
+@router.get("/profiles")
+async def list_profiles(current_user: User = Depends(get_current_admin)):
+    """
+    Lista los perfiles de rendimiento capturados (del más reciente al más antiguo)
+    Solo se guardan los últimos PROFILING_MAX_PROFILES
+    """
+    return [profile.summary() for profile in profile_store.list()]
+
+
+@router.get("/profiles/{profile_id}")
+async def download_profile(profile_id: str, current_user: User = Depends(get_current_admin)):
+    """
+    Descarga un perfil en formato speedscope
+    Se abre en https://www.speedscope.app (vistas de flamegraph, left heavy y sandwich)
+    """
+    profile = profile_store.get(profile_id)
+    if not profile:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Perfil no encontrado"
+        )
+    
+    return JSONResponse(
+        content=profile.to_speedscope(),
+        headers={"Content-Disposition": f'attachment; filename="profile-{profile.id}.speedscope.json"'}
+    )
+
+
+@router.get("/geocoding")
+async def geocoding_status(current_user: User = Depends(get_current_admin)):
+    """
+    Estado de los proveedores de geocoding: circuit breaker (closed, open, half_open),
+    aciertos, fallos y latencias p50/p95 recientes
+    """
+    return geocoder.status()
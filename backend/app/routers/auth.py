@@ -6,6 +6,7 @@ from app.models.user import User
 from app.schemas.user import UserCreate
 from app.core.auth import create_access_token, get_current_user
 from app.core.config import settings
+from app.crud.user_crud import UserCRUD
 from datetime import datetime
 import logging
 
@@ -64,6 +65,7 @@ async def auth_google(request: Request):
                 oauth_id=user_info.get('sub')
             )
             await user.insert()
+            await UserCRUD.sync_search_keys(user)
             logging.info(f"Nuevo usuario creado: {email}")
         else:
             # Actualizar último login
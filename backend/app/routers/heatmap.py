@@ -0,0 +1,25 @@
+from fastapi import APIRouter, HTTPException, Query, status
+from app.core.heatmap import heatmap_service
+
+router = APIRouter(prefix="/heatmap", tags=["Heatmap"])
+
+
+@router.get("")
+async def get_heatmap(
+    zoom: int = Query(0, ge=0, le=22, description="Nivel de zoom del mapa"),
+    south: float = Query(-90.0, ge=-90.0, le=90.0),
+    west: float = Query(-180.0, ge=-180.0, le=180.0),
+    north: float = Query(90.0, ge=-90.0, le=90.0),
+    east: float = Query(180.0, ge=-180.0, le=180.0)
+):
+    """
+    Mapa de calor global de los lugares visitados por todos los usuarios
+    Se sirve desde rejillas precalculadas, así que el coste no depende del número de marcadores
+    Si west > east el viewport cruza el antimeridiano
+    """
+    if south > north:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="south no puede ser mayor que north"
+        )
+    return await heatmap_service.query(zoom, south, west, north, east)
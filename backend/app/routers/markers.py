@@ -1,48 +1,46 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, status
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Query, Request, Response, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
 from typing import List, Optional
 from app.models.user import User
-from app.models.marker import Marker
-from app.schemas.marker import MarkerCreate, MarkerUpdate
+from app.schemas.marker import MarkerBulkDelete, MarkerBulkUpdate, MarkerCreate, MarkerUpdate
 from app.crud.marker_crud import MarkerCRUD
 from app.crud.visit_crud import VisitCRUD
 from app.core.auth import get_current_user, get_current_user_optional
 from app.core.geocoding import geocode_location
+from app.core.gazetteer import Place, get_place_index
 from beanie import PydanticObjectId
-import cloudinary
-import cloudinary.uploader
 from app.core.config import settings
+from app.core.images import is_data_url, upload_data_url, upload_image_to_cloudinary
+from app.core.marker_jobs import marker_job_worker
+from app.crud.marker_job_crud import MarkerJobCRUD
+from app.crud.stats_crud import StatsCRUD
+from app.models.user_stats import UserStats
+from app.core.vector_tiles import encode_point_layer, is_valid_tile, marker_tile_cache, tile_bounds
+from app.core.events import TooManySubscribersError, event_bus
+from app.core.map_payload import (
+    COLUMNAR_JSON_MEDIA_TYPE,
+    COLUMNAR_MSGPACK_MEDIA_TYPE,
+    build_columnar_map,
+    negotiate_map_format,
+    pack_msgpack,
+)
+import asyncio
+import hashlib
 import logging
 
 router = APIRouter(prefix="/markers", tags=["Markers"])
 
-# Configurar Cloudinary (obligatorio)
-cloudinary.config(
-    cloud_name=settings.CLOUDINARY_CLOUD_NAME,
-    api_key=settings.CLOUDINARY_API_KEY,
-    api_secret=settings.CLOUDINARY_API_SECRET
-)
-
 
-async def upload_image_to_cloudinary(file: UploadFile) -> str:
-    """Sube una imagen a Cloudinary y retorna la URL"""
-    try:
-        # Leer el contenido del archivo
-        contents = await file.read()
-        
-        # Subir a Cloudinary
-        result = cloudinary.uploader.upload(
-            contents,
-            folder="mimapa",
-            resource_type="image"
-        )
-        
-        return result['secure_url']
-    except Exception as e:
-        logging.error(f"Error subiendo imagen a Cloudinary: {str(e)}")
+def resolve_place(place_id: str) -> Place:
+    """Lugar del gazetteer local (place_id de /places/autocomplete)"""
+    place = get_place_index().get(place_id)
+    if not place:
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Error al subir la imagen"
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"place_id desconocido: {place_id}"
         )
+    return place
 
 
 @router.post("/", status_code=status.HTTP_201_CREATED)
@@ -55,22 +53,27 @@ async def create_marker(
     - Geocodifica la ubicación para obtener coordenadas
     - La imagen debe venir como URL de Cloudinary o base64 (se convertirá a Cloudinary)
     """
-    # Geocodificar la ubicación
-    coordinates = await geocode_location(marker_data.location_name)
+    # Lugar elegido en el autocompletado: nombre y coordenadas del gazetteer, sin geocoding remoto
+    location_name = marker_data.location_name
+    if marker_data.place_id:
+        place = resolve_place(marker_data.place_id)
+        location_name = place.display_name
+        coordinates = place.latitude, place.longitude
+    else:
+        coordinates = await geocode_location(location_name)
     if not coordinates:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"No se pudieron encontrar coordenadas para: {marker_data.location_name}"
+            detail=f"No se pudieron encontrar coordenadas para: {location_name}"
         )
     
     latitude, longitude = coordinates
     
     # Procesar image_url: si viene como base64, subir a Cloudinary
     image_url = marker_data.image_url
-    if image_url and image_url.startswith('data:image'):
+    if image_url and is_data_url(image_url):
         try:
-            result = cloudinary.uploader.upload(image_url, folder="mimapa")
-            image_url = result['secure_url']
+            image_url = await upload_data_url(image_url)
         except Exception as e:
             logging.error(f"Error subiendo imagen base64 a Cloudinary: {str(e)}")
             raise HTTPException(
@@ -81,7 +84,7 @@ async def create_marker(
     # Crear marcador
     marker = await MarkerCRUD.create_marker(
         user_email=current_user.email,
-        location_name=marker_data.location_name,
+        location_name=location_name,
         latitude=latitude,
         longitude=longitude,
         image_url=image_url,
@@ -94,22 +97,153 @@ async def create_marker(
     return marker_dict
 
 
+@router.post("/async", status_code=status.HTTP_202_ACCEPTED)
+async def create_marker_async(
+    marker_data: MarkerCreate,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Crea un marcador de forma asíncrona para el usuario autenticado
+    - Inserta el marcador con status "pending" y responde 202 de inmediato
+    - El geocoding y la subida de la imagen se hacen en segundo plano (con reintentos)
+    - Consulta GET /markers/{marker_id}/status para saber cuándo está listo
+    """
+    # Con place_id el worker no necesita geocodificar y se guarda el nombre del gazetteer
+    location_name = marker_data.location_name
+    latitude = longitude = None
+    if marker_data.place_id:
+        place = resolve_place(marker_data.place_id)
+        location_name = place.display_name
+        latitude, longitude = place.latitude, place.longitude
+    
+    marker = await MarkerCRUD.create_pending_marker(
+        user_email=current_user.email,
+        location_name=location_name,
+        description=marker_data.description
+    )
+    
+    image_url = marker_data.image_url
+    job = await MarkerJobCRUD.create_job(
+        marker_id=marker.id,
+        user_email=current_user.email,
+        location_name=location_name,
+        latitude=latitude,
+        longitude=longitude,
+        image_data=image_url if image_url and is_data_url(image_url) else None,
+        image_url=image_url if image_url and not is_data_url(image_url) else None
+    )
+    marker_job_worker.enqueue(job.id)
+    
+    # Serializar con id explícito
+    marker_dict = marker.model_dump(by_alias=True)
+    marker_dict['id'] = str(marker.id)
+    marker_dict['status_url'] = f"/markers/{marker.id}/status"
+    return marker_dict
+
+
 @router.get("/my-markers")
-async def get_my_markers(current_user: User = Depends(get_current_user)):
-    """Obtiene todos los marcadores del usuario autenticado"""
-    markers = await MarkerCRUD.get_user_markers(current_user.email)
+async def get_my_markers(
+    include_pending: bool = False,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Obtiene todos los marcadores del usuario autenticado
+    Con include_pending=true incluye también los pendientes o fallidos de la creación asíncrona
+    """
+    markers = await MarkerCRUD.get_user_markers(current_user.email, include_pending=include_pending)
     # Serializar con id explícito
     return [
         {**m.model_dump(by_alias=True), 'id': str(m.id)} for m in markers
     ]
 
 
+def serialize_stats(stats: UserStats) -> dict:
+    """Serializa las estadísticas del usuario"""
+    return {
+        "user_email": stats.user_email,
+        "places_count": stats.places_count,
+        "countries_count": len(stats.countries),
+        "countries": stats.countries,
+        "first_trip": stats.first_trip,
+        "last_trip": stats.last_trip,
+        "total_distance_km": round(stats.total_distance_km, 1)
+    }
+
+
+@router.get("/stats")
+async def get_my_stats(current_user: User = Depends(get_current_user)):
+    """
+    Obtiene las estadísticas de viaje del usuario autenticado
+    Lee el documento materializado (distancia y primer/último viaje se recalculan si hubo cambios)
+    """
+    stats = await StatsCRUD.get_stats(current_user.email)
+    return serialize_stats(stats)
+
+
+@router.post("/stats/rebuild")
+async def rebuild_my_stats(current_user: User = Depends(get_current_user)):
+    """Recalcula desde cero las estadísticas de viaje del usuario autenticado"""
+    stats = await StatsCRUD.rebuild_stats(current_user.email)
+    return serialize_stats(stats)
+
+
+@router.get("/tiles/{email}/{z}/{x}/{y}.mvt")
+async def get_marker_tile(email: str, z: int, x: int, y: int, request: Request):
+    """
+    Obtiene los marcadores de un usuario dentro de una tesela como Mapbox Vector Tile
+    - Capa "markers" con propiedades id, location_name e image_url
+    - Las teselas se cachean en el servidor y se invalidan al cambiar los marcadores del usuario
+    - ETag + Cache-Control permiten al navegador reutilizar las teselas ya descargadas
+    """
+    if not is_valid_tile(z, x, y):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Coordenadas de tesela inválidas"
+        )
+    
+    tile = marker_tile_cache.get(email, z, x, y)
+    if tile is None:
+        south, west, north, east = tile_bounds(z, x, y)
+        # Del primario: la tesela queda cacheada, así que no puede venir de un secundario retrasado
+        markers = await MarkerCRUD.get_markers_in_bounds(email, south, west, north, east, query_class="primary")
+        tile = encode_point_layer(
+            "markers",
+            [
+                (
+                    m["latitude"],
+                    m["longitude"],
+                    {"id": str(m["_id"]), "location_name": m["location_name"], "image_url": m.get("image_url")}
+                )
+                for m in markers
+            ],
+            z, x, y
+        )
+        marker_tile_cache.set(email, z, x, y, tile)
+    
+    etag = f'"{hashlib.sha1(tile).hexdigest()}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={settings.TILE_BROWSER_MAX_AGE_SECONDS}"
+    }
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=tile, media_type="application/vnd.mapbox-vector-tile", headers=headers)
+
+
 @router.get("/user/{email}")
-async def get_user_map(email: str, current_user: Optional[User] = Depends(get_current_user_optional)):
+async def get_user_map(
+    email: str,
+    request: Request,
+    response: Response,
+    payload_format: Optional[str] = Query(None, alias="format", description="json, columnar o msgpack"),
+    current_user: Optional[User] = Depends(get_current_user_optional)
+):
     """
     Obtiene el mapa de otro usuario (solo lectura)
     Permite visualizar los marcadores de otros usuarios ingresando su email
     Registra la visita si el usuario está autenticado
+    Formato según Accept (o ?format=): JSON por defecto, o columnar compacto
+    (application/vnd.mimapa.map+json / application/vnd.mimapa.map+msgpack)
     """
     # Buscar el usuario
     user = await User.find_one(User.email == email)
@@ -127,8 +261,19 @@ async def get_user_map(email: str, current_user: Optional[User] = Depends(get_cu
             visitor_oauth_id=current_user.oauth_id
         )
     
-    # Obtener marcadores del usuario
-    markers = await MarkerCRUD.get_user_markers(email)
+    # Obtener marcadores del usuario (lectura pública, puede servirla un secundario)
+    markers = await MarkerCRUD.get_user_markers(email, query_class="public")
+    
+    # Vary en todas las variantes para que ninguna caché sirva un formato por otro
+    headers = {"Vary": "Accept"}
+    fmt = negotiate_map_format(request.headers.get("accept"), payload_format)
+    if fmt != "json":
+        payload = build_columnar_map(user.email, user.name, markers)
+        if fmt == "msgpack":
+            return Response(content=pack_msgpack(payload), media_type=COLUMNAR_MSGPACK_MEDIA_TYPE, headers=headers)
+        return JSONResponse(content=jsonable_encoder(payload), media_type=COLUMNAR_JSON_MEDIA_TYPE, headers=headers)
+    
+    response.headers.update(headers)
     
     # Serializar con id explícito
     markers_data = [
@@ -142,6 +287,205 @@ async def get_user_map(email: str, current_user: Optional[User] = Depends(get_cu
     }
 
 
+# Eventos visibles para cualquiera que vea el mapa (los pendientes/fallidos son del propietario)
+PUBLIC_MARKER_EVENTS = {"marker.created", "marker.ready", "marker.updated", "marker.deleted", "markers.changed"}
+
+# Cabeceras para que proxies (nginx, Vercel) no almacenen ni agrupen el flujo SSE
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+@router.get("/user/{email}/events")
+async def stream_user_map_events(email: str, request: Request):
+    """
+    Flujo Server-Sent Events con los cambios en el mapa de un usuario
+    Eventos: marker.created, marker.ready, marker.updated, marker.deleted y markers.changed (lotes)
+    Sustituye al sondeo periódico de /markers/user/{email}
+    """
+    if not await User.find_one(User.email == email):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"No se encontró un usuario con el email: {email}"
+        )
+    
+    try:
+        subscription = event_bus.subscribe(f"markers:{email}")
+    except TooManySubscribersError:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Demasiadas conexiones en vivo para este mapa, inténtalo más tarde"
+        )
+    
+    return StreamingResponse(
+        event_bus.stream(
+            subscription, request.is_disconnected, settings.EVENT_HEARTBEAT_SECONDS, PUBLIC_MARKER_EVENTS
+        ),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
+    )
+
+
+async def geocode_many(location_names: List[str]) -> dict:
+    """Geocodifica nombres distintos de forma concurrente (con límite de concurrencia)"""
+    semaphore = asyncio.Semaphore(settings.MARKER_BULK_GEOCODE_CONCURRENCY)
+    
+    async def geocode_one(name: str):
+        async with semaphore:
+            return name, await geocode_location(name)
+    
+    return dict(await asyncio.gather(*(geocode_one(name) for name in set(location_names))))
+
+
+@router.post("/bulk/update")
+async def bulk_update_markers(
+    bulk_data: MarkerBulkUpdate,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Actualiza varios marcadores del usuario autenticado en una sola operación
+    - Los nombres de ubicación repetidos se geocodifican una sola vez y en paralelo
+    - Devuelve el resultado de cada elemento: updated, not_found, conflict, pending, invalid_id o geocode_failed
+    """
+    ids = [item.id for item in bulk_data.items]
+    results = {}
+    parsed = {}
+    for item in bulk_data.items:
+        try:
+            parsed[item.id] = PydanticObjectId(item.id)
+        except Exception:
+            results[item.id] = {"id": item.id, "status": "invalid_id"}
+    # Se compara el ObjectId y no el texto: "6AD6..." y "6ad6..." son el mismo marcador
+    if len(set(parsed.values())) != len(parsed) or len(set(ids)) != len(ids):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Hay IDs de marcador repetidos"
+        )
+    
+    # Solo se geocodifican los nombres de marcadores propios y no pendientes
+    states = await MarkerCRUD.get_owned_marker_states(list(parsed.values()), current_user.email)
+    editable = []
+    for item in bulk_data.items:
+        if item.id not in parsed:
+            continue
+        state = states.get(parsed[item.id])
+        if state is None:
+            results[item.id] = {"id": item.id, "status": "not_found", "version": None}
+        elif state[0] == "pending":
+            results[item.id] = {"id": item.id, "status": "pending", "version": state[1]}
+        else:
+            editable.append(item)
+    
+    coordinates = await geocode_many([
+        item.location_name for item in editable if item.location_name is not None
+    ])
+    
+    updates = []
+    requested_ids = {}
+    for item in editable:
+        object_id = parsed[item.id]
+        fields = item.model_dump(exclude_unset=True, exclude={"id", "version"})
+        if "location_name" in fields:
+            if not coordinates.get(fields["location_name"]):
+                results[item.id] = {"id": item.id, "status": "geocode_failed"}
+                continue
+            fields["latitude"], fields["longitude"] = coordinates[fields["location_name"]]
+        updates.append((object_id, fields, item.version))
+        requested_ids[object_id] = item.id
+    
+    if updates:
+        outcome = await MarkerCRUD.bulk_update_markers(current_user.email, updates)
+        for object_id, (item_status, version) in outcome.items():
+            item_id = requested_ids[object_id]
+            results[item_id] = {"id": item_id, "status": item_status, "version": version}
+    
+    ordered = [results[item_id] for item_id in ids]
+    return {
+        "updated": sum(1 for r in ordered if r["status"] == "updated"),
+        "results": ordered
+    }
+
+
+@router.post("/bulk/delete")
+async def bulk_delete_markers(
+    bulk_data: MarkerBulkDelete,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Elimina varios marcadores del usuario autenticado en una sola operación
+    Acepta una lista de IDs o un filtro (location_name, created_before, created_after)
+    """
+    results = {}
+    object_ids = None
+    if bulk_data.ids is not None:
+        object_ids = []
+        for marker_id in bulk_data.ids:
+            try:
+                object_ids.append(PydanticObjectId(marker_id))
+            except Exception:
+                results[marker_id] = {"id": marker_id, "status": "invalid_id"}
+        if not object_ids:
+            return {"deleted": 0, "results": list(results.values())}
+    
+    deleted_ids = await MarkerCRUD.bulk_delete_markers(
+        current_user.email,
+        marker_ids=object_ids,
+        filters=bulk_data.filter.model_dump(exclude_none=True) if bulk_data.filter else None,
+        max_items=settings.MARKER_BULK_MAX_ITEMS
+    )
+    if deleted_ids is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"El filtro coincide con más de {settings.MARKER_BULK_MAX_ITEMS} marcadores, acótalo"
+        )
+    
+    deleted = {str(marker_id) for marker_id in deleted_ids}
+    if bulk_data.ids is not None:
+        for marker_id in bulk_data.ids:
+            if marker_id not in results:
+                results[marker_id] = {
+                    "id": marker_id,
+                    "status": "deleted" if str(PydanticObjectId(marker_id)) in deleted else "not_found"
+                }
+        ordered = [results[marker_id] for marker_id in bulk_data.ids]
+    else:
+        ordered = [{"id": marker_id, "status": "deleted"} for marker_id in sorted(deleted)]
+    
+    return {"deleted": len(deleted), "results": ordered}
+
+
+@router.get("/{marker_id}/status")
+async def get_marker_status(
+    marker_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Consulta el estado de un marcador creado de forma asíncrona
+    status: "pending" (en proceso), "ready" (completado) o "failed" (ver error)
+    """
+    try:
+        object_id = PydanticObjectId(marker_id)
+    except Exception:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="ID de marcador inválido"
+        )
+    
+    marker = await MarkerCRUD.get_marker_by_id(object_id)
+    if not marker or marker.user_email != current_user.email:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Marcador no encontrado o no autorizado"
+        )
+    
+    marker_dict = marker.model_dump(by_alias=True)
+    marker_dict['id'] = str(marker.id)
+    return {
+        "id": str(marker.id),
+        "status": marker.status,
+        "error": marker.processing_error,
+        "marker": marker_dict if marker.status == "ready" else None
+    }
+
+
 @router.delete("/{marker_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_marker(
     marker_id: str,
@@ -166,6 +510,29 @@ async def delete_marker(
     return None
 
 
+def raise_update_failure(marker_status: Optional[str]) -> None:
+    """
+    Traduce una actualización no aplicada a su error HTTP según el estado actual del marcador
+    - None: no existe o no pertenece al usuario (404)
+    - "pending": la creación asíncrona aún no terminó y sobrescribiría el cambio (409)
+    - otro: la versión esperada no coincide (409)
+    """
+    if marker_status is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Marcador no encontrado o no autorizado"
+        )
+    if marker_status == "pending":
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="El marcador aún se está procesando, inténtalo cuando esté listo"
+        )
+    raise HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail="El marcador fue modificado por otra petición, recárgalo e inténtalo de nuevo"
+    )
+
+
 @router.put("/{marker_id}")
 async def update_marker(
     marker_id: str,
@@ -181,31 +548,30 @@ async def update_marker(
             detail="ID de marcador inválido"
         )
     
-    marker = await Marker.get(object_id)
-    if not marker or marker.user_email != current_user.email:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Marcador no encontrado o no autorizado"
-        )
-    
     # Actualizar solo los campos proporcionados
     update_data = marker_data.model_dump(exclude_unset=True)
+    expected_version = update_data.pop("version", None)
     
     # Si se actualiza location_name, recalcular coordenadas
     if "location_name" in update_data:
+        # Comprobar propietario y estado antes de llamar al geocoder
+        marker_status = await MarkerCRUD.get_owned_marker_status(object_id, current_user.email)
+        if marker_status in (None, "pending"):
+            raise_update_failure(marker_status)
         coordinates = await geocode_location(update_data["location_name"])
         if not coordinates:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"No se pudieron encontrar coordenadas para: {update_data['location_name']}"
             )
-        marker.latitude, marker.longitude = coordinates
-        marker.location_name = update_data["location_name"]
-    
-    if "description" in update_data:
-        marker.description = update_data["description"]
+        update_data["latitude"], update_data["longitude"] = coordinates
     
-    await marker.save()
+    # Un único find_one_and_update filtrado por propietario (y versión si se indica)
+    marker = await MarkerCRUD.update_marker(
+        object_id, current_user.email, update_data, expected_version=expected_version
+    )
+    if not marker:
+        raise_update_failure(await MarkerCRUD.get_owned_marker_status(object_id, current_user.email))
     
     # Serializar con id explícito
     marker_dict = marker.model_dump(by_alias=True)
@@ -228,16 +594,18 @@ async def update_marker_image(
             detail="ID de marcador inválido"
         )
     
+    # Comprobar propietario y estado antes de subir nada a Cloudinary
+    marker_status = await MarkerCRUD.get_owned_marker_status(object_id, current_user.email)
+    if marker_status in (None, "pending"):
+        raise_update_failure(marker_status)
+    
     # Subir imagen a Cloudinary
     image_url = await upload_image_to_cloudinary(image)
     
     # Actualizar marcador
     marker = await MarkerCRUD.update_marker_image(object_id, current_user.email, image_url)
     if not marker:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Marcador no encontrado o no autorizado"
-        )
+        raise_update_failure(await MarkerCRUD.get_owned_marker_status(object_id, current_user.email))
     
     # Serializar con id explícito
     marker_dict = marker.model_dump(by_alias=True)
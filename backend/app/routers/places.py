@@ -0,0 +1,18 @@
+from fastapi import APIRouter, Query
+from app.core.gazetteer import get_place_index
+
+router = APIRouter(prefix="/places", tags=["Places"])
+
+
+@router.get("/autocomplete")
+async def autocomplete_places(
+    q: str = Query(..., min_length=1, max_length=200, description="Texto escrito por el usuario"),
+    limit: int = Query(10, ge=1, le=20)
+):
+    """
+    Sugerencias de lugares para el formulario de creación de marcadores
+    Se resuelven sobre un gazetteer local en memoria (sin llamadas a servicios externos)
+    Envía el place_id elegido al crear el marcador para evitar el geocoding remoto
+    """
+    places = get_place_index().autocomplete(q, limit=limit)
+    return {"results": [place.to_dict() for place in places]}
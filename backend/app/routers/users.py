@@ -0,0 +1,63 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from typing import Optional
+from app.models.user import User
+from app.crud.user_crud import UserCRUD, decode_search_cursor, encode_search_cursor
+from app.core.auth import get_current_user
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core.utils import normalize_text
+
+router = APIRouter(prefix="/users", tags=["Users"])
+
+# Caché de los prefijos más buscados (se reutiliza entre peticiones del mismo proceso)
+search_cache = TTLCache(
+    maxsize=settings.USER_SEARCH_CACHE_SIZE,
+    ttl_seconds=settings.USER_SEARCH_CACHE_TTL_SECONDS
+)
+
+
+@router.get("/search")
+async def search_users(
+    q: str = Query(..., min_length=1, max_length=100, description="Prefijo del nombre o email completo"),
+    limit: int = Query(10, ge=1, le=50),
+    cursor: Optional[str] = Query(None, description="Cursor devuelto por la página anterior"),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Busca usuarios para descubrir sus mapas
+    - Por prefijo del nombre, con paginación por cursor (pasa next_cursor para la siguiente página)
+    - Por email solo si q es el email completo: no se pueden enumerar emails por prefijo
+    """
+    if "@" in q:
+        user = await UserCRUD.get_user_by_email(q)
+        return {
+            "results": [{"email": user.email, "name": user.name, "picture": user.picture}] if user else [],
+            "next_cursor": None
+        }
+    
+    position = None
+    if cursor is not None:
+        try:
+            position = decode_search_cursor(cursor)
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="cursor inválido"
+            )
+    
+    cache_key = (normalize_text(q), limit, cursor)
+    cached = search_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    
+    users, next_position = await UserCRUD.search_users(q, limit=limit, cursor=position)
+    
+    # Solo datos públicos del perfil (el email es el identificador del mapa)
+    response = {
+        "results": [
+            {"email": u.email, "name": u.name, "picture": u.picture} for u in users
+        ],
+        "next_cursor": encode_search_cursor(next_position) if next_position else None
+    }
+    search_cache.set(cache_key, response)
+    return response
@@ -1,9 +1,12 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi.responses import StreamingResponse
 from typing import List
 from app.models.user import User
 from app.models.visit import Visit
 from app.crud.visit_crud import VisitCRUD
-from app.core.auth import get_current_user
+from app.core.auth import get_current_user, get_current_user_sse
+from app.core.config import settings
+from app.core.events import TooManySubscribersError, event_bus
 
 router = APIRouter(prefix="/visits", tags=["Visits"])
 
@@ -22,6 +25,27 @@ async def get_my_visits(current_user: User = Depends(get_current_user)):
     ]
 
 
+@router.get("/my-visits/events")
+async def stream_my_visits(request: Request, current_user: User = Depends(get_current_user_sse)):
+    """
+    Flujo Server-Sent Events con las nuevas visitas al mapa del usuario actual (evento visit.created)
+    EventSource no permite cabeceras: el token puede enviarse en ?access_token=
+    """
+    try:
+        subscription = event_bus.subscribe(f"visits:{current_user.email}")
+    except TooManySubscribersError:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Demasiadas conexiones en vivo, inténtalo más tarde"
+        )
+    
+    return StreamingResponse(
+        event_bus.stream(subscription, request.is_disconnected, settings.EVENT_HEARTBEAT_SECONDS),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @router.post("/register")
 async def register_visit(
     visited_user_email: str,
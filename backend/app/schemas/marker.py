@@ -1,13 +1,46 @@
-from pydantic import BaseModel, Field
-from typing import Optional
+from pydantic import BaseModel, Field, model_validator
+from typing import List, Optional
+from datetime import datetime
+from app.core.config import settings
 
 # Schema para crear marcadores
 class MarkerCreate(BaseModel):
     location_name: str = Field(..., min_length=1, max_length=200, description="Nombre del país o ciudad")
     description: Optional[str] = Field(None, max_length=1000, description="Descripción del lugar visitado")
     image_url: Optional[str] = Field(None, description="URL de la imagen (base64 o URL de Cloudinary)")
+    place_id: Optional[str] = Field(None, max_length=50, description="ID de /places/autocomplete; si se indica no se geocodifica y location_name se toma del lugar")
 
 # Schema para actualizar marcadores
 class MarkerUpdate(BaseModel):
     location_name: Optional[str] = Field(None, min_length=1, max_length=200, description="Nombre del país o ciudad")
     description: Optional[str] = Field(None, max_length=1000, description="Descripción del lugar visitado")
+    version: Optional[int] = Field(None, ge=0, description="Versión esperada del marcador (control de concurrencia optimista)")
+
+# Schemas para operaciones en lote
+class MarkerBulkUpdateItem(MarkerUpdate):
+    id: str = Field(..., description="ID del marcador")
+
+class MarkerBulkUpdate(BaseModel):
+    items: List[MarkerBulkUpdateItem] = Field(..., min_length=1, max_length=settings.MARKER_BULK_MAX_ITEMS)
+
+class MarkerBulkDeleteFilter(BaseModel):
+    location_name: Optional[str] = Field(None, min_length=1, max_length=200, description="Texto contenido en el nombre (sin distinguir mayúsculas)")
+    created_before: Optional[datetime] = None
+    created_after: Optional[datetime] = None
+    
+    @model_validator(mode="after")
+    def check_has_criteria(self):
+        # Un filtro vacío coincidiría con todos los marcadores del usuario
+        if self.location_name is None and self.created_before is None and self.created_after is None:
+            raise ValueError("El filtro debe indicar al menos un criterio")
+        return self
+
+class MarkerBulkDelete(BaseModel):
+    ids: Optional[List[str]] = Field(None, min_length=1, max_length=settings.MARKER_BULK_MAX_ITEMS)
+    filter: Optional[MarkerBulkDeleteFilter] = None
+    
+    @model_validator(mode="after")
+    def check_ids_or_filter(self):
+        if (self.ids is None) == (self.filter is None):
+            raise ValueError("Indica ids o filter (solo uno de los dos)")
+        return self
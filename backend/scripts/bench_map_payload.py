@@ -0,0 +1,117 @@
+"""
+Benchmark del formato de respuesta de /markers/user/{email}
+Compara tamaño (sin comprimir y con gzip) y tiempo de decodificación del JSON actual
+frente al formato columnar en JSON y en MessagePack
+
+Uso (desde backend/):
+    python -m scripts.bench_map_payload --markers 50 500 5000
+"""
+import argparse
+import gzip
+import json
+import random
+import time
+from datetime import datetime, timedelta
+from beanie import PydanticObjectId
+from app.models.marker import Marker
+from app.core.map_payload import build_columnar_map, decode_columnar_map, pack_msgpack, unpack_msgpack
+
+USER_EMAIL = "traveler.example@gmail.com"
+CITIES = [
+    ("Madrid, Spain", 40.4168, -3.7038), ("Paris, France", 48.8566, 2.3522),
+    ("Roma, Italy", 41.9028, 12.4964), ("Berlin, Germany", 52.52, 13.405),
+    ("Lisboa, Portugal", 38.7223, -9.1393), ("Tokyo, Japan", 35.6762, 139.6503),
+    ("New York, United States", 40.7128, -74.006), ("Buenos Aires, Argentina", -34.6037, -58.3816),
+    ("Sydney, Australia", -33.8688, 151.2093), ("Cairo, Egypt", 30.0444, 31.2357),
+]
+
+
+def fake_markers(count: int, seed: int = 42) -> list:
+    """Marcadores sintéticos con una mezcla realista de imágenes y descripciones"""
+    rng = random.Random(seed)
+    start = datetime(2020, 1, 1)
+    markers = []
+    for i in range(count):
+        name, lat, lon = rng.choice(CITIES)
+        markers.append(Marker.model_construct(
+            id=PydanticObjectId(),
+            user_email=USER_EMAIL,
+            location_name=name,
+            latitude=lat + rng.uniform(-0.5, 0.5),
+            longitude=lon + rng.uniform(-0.5, 0.5),
+            image_url=f"https://res.cloudinary.com/demo/image/upload/v1/mimapa/{i:06d}.jpg" if rng.random() < 0.6 else None,
+            description="Una visita para recordar" if rng.random() < 0.3 else None,
+            created_at=start + timedelta(minutes=rng.randint(0, 60 * 24 * 365 * 4)),
+            version=rng.randint(0, 3),
+            status="ready",
+            processing_error=None,
+        ))
+    return markers
+
+
+def current_json(markers: list) -> bytes:
+    """Cuerpo que devuelve hoy el endpoint (mismo serializado que FastAPI)"""
+    body = {
+        "user_email": USER_EMAIL,
+        "user_name": "Traveler",
+        "markers": [{**m.model_dump(mode="json", by_alias=True), "id": str(m.id)} for m in markers],
+    }
+    return json.dumps(body, separators=(",", ":")).encode("utf-8")
+
+
+def best_time(fn, repeat: int) -> float:
+    """Mejor tiempo de repeat ejecuciones, en milisegundos"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def run(count: int, repeat: int) -> None:
+    markers = fake_markers(count)
+    columnar = build_columnar_map(USER_EMAIL, "Traveler", markers)
+    bodies = {
+        "json (actual)": current_json(markers),
+        "columnar json": json.dumps(columnar, separators=(",", ":")).encode("utf-8"),
+        "columnar msgpack": pack_msgpack(columnar),
+    }
+    # parse: solo deserializar (un cliente puede pintar directamente desde las columnas)
+    # filas: además reconstruir la lista de marcadores como en la respuesta JSON
+    parsers = {
+        "json (actual)": json.loads,
+        "columnar json": json.loads,
+        "columnar msgpack": unpack_msgpack,
+    }
+    to_rows = {
+        "json (actual)": lambda payload: payload["markers"],
+        "columnar json": decode_columnar_map,
+        "columnar msgpack": decode_columnar_map,
+    }
+    baseline = len(bodies["json (actual)"])
+    baseline_gzip = len(gzip.compress(bodies["json (actual)"]))
+    
+    print(f"\n{count} marcadores")
+    print(f"{'formato':<18}{'bytes':>10}{'ratio':>8}{'gzip':>10}{'ratio':>8}{'parse ms':>11}{'filas ms':>11}")
+    for name, body in bodies.items():
+        compressed = len(gzip.compress(body))
+        parse_ms = best_time(lambda: parsers[name](body), repeat)
+        rows_ms = best_time(lambda: to_rows[name](parsers[name](body)), repeat)
+        print(
+            f"{name:<18}{len(body):>10}{baseline / len(body):>7.1f}x"
+            f"{compressed:>10}{baseline_gzip / compressed:>7.1f}x{parse_ms:>11.3f}{rows_ms:>11.3f}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--markers", type=int, nargs="+", default=[50, 500, 5000])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    for count in args.markers:
+        run(count, args.repeat)
+
+
+if __name__ == "__main__":
+    main()